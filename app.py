@@ -1,18 +1,16 @@
 import base64
 import os
 import sqlite3
+from functools import lru_cache
 from io import BytesIO
 
 import dash
 import pandas as pd
-import plotly.express as px
 from dash import dcc, html, Input, Output
 from flask import Flask, render_template, redirect, url_for, request, flash
 from flask_bcrypt import Bcrypt
 from flask_login import LoginManager, UserMixin, login_user, current_user, logout_user, login_required
 from flask_sqlalchemy import SQLAlchemy
-from plotly.graph_objs import Scatter
-from wordcloud import WordCloud
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'a_random_secret_key_123456'
@@ -86,6 +84,8 @@ def dashboard():
 
 # Function to generate word cloud image from topics in the database
 def generate_wordcloud_from_db(db_path):
+    from wordcloud import WordCloud
+
     conn = sqlite3.connect(db_path)
     query = "SELECT topic_title, post_count FROM topics"
     df = pd.read_sql(query, conn)
@@ -104,6 +104,7 @@ def generate_wordcloud_from_db(db_path):
 
 def generate_wordcloud_from_keywords(db_path, topic_title):
     import sqlite3
+    from wordcloud import WordCloud
 
     conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
@@ -220,14 +221,6 @@ def create_dashboard(server):
         server=server,
         url_base_pathname='/dash_app/',
     )
-    # Connect to SQLite database and retrieve data
-    conn = sqlite3.connect('weibo.db')
-    query = "SELECT topic_title, hot_rate FROM topics"
-    df = pd.read_sql_query(query, conn)
-    conn.close()
-
-    # Select top 10 topics by hot_rate
-    df = df.sort_values(by='hot_rate', ascending=False).head(10)
     # Sample data for sentiment and frequency charts
     sentiment_data = {
         'Category': ['Positive', 'Negative', 'Neutral'],
@@ -254,43 +247,58 @@ def create_dashboard(server):
         'backgroundColor': 'rgba(0, 0, 0, 0.6)'  # Black color with opacity for better readability
     }
 
-    main_page_layout = html.Div(style=content_style, children=[
-        html.H1("首页", style={'textAlign': 'center', 'color': '#fff'}),
+    # 首页需要查询数据库并绘制词云，在第一次访问时才生成，启动时不做这些工作
+    @lru_cache(maxsize=None)
+    def main_page_layout():
+        # Connect to SQLite database and retrieve data
+        conn = sqlite3.connect('weibo.db')
+        query = "SELECT topic_title, hot_rate FROM topics"
+        df = pd.read_sql_query(query, conn)
+        conn.close()
 
-        html.Div([
-            html.H2('Bar Chart', style={'color': '#fff'}),
-            dcc.Graph(
-                id='bar-chart',
-                figure={
-                    'data': [
-                        {'y': df['topic_title'], 'x': df['hot_rate'], 'type': 'bar', 'orientation': 'h',
-                         'name': 'Topics', 'marker': {'color': '#ff9900'}
-                         },
-                    ],
-                    'layout': {
-                        'title': {
-                            'text': '热门话题TOP10',
-                            'font': {'size': 50, 'color': 'red', 'family': 'KaiTi'}
-                        },
-                        'plot_bgcolor': 'rgba(0,0,0,0)',
-                        'paper_bgcolor': 'rgba(0,0,0,0)',
-                        'font': {'color': '#fff'},
-                        'yaxis': {'automargin': True, 'dtick': 1, 'tickfont': {'size': 20}},
-                        'xaxis': {'tickfont': {'size': 20}},
-                        'height': 800
+        # Select top 10 topics by hot_rate
+        df = df.sort_values(by='hot_rate', ascending=False).head(10)
+
+        return html.Div(style=content_style, children=[
+            html.H1("首页", style={'textAlign': 'center', 'color': '#fff'}),
+
+            html.Div([
+                html.H2('Bar Chart', style={'color': '#fff'}),
+                dcc.Graph(
+                    id='bar-chart',
+                    figure={
+                        'data': [
+                            {'y': df['topic_title'], 'x': df['hot_rate'], 'type': 'bar', 'orientation': 'h',
+                             'name': 'Topics', 'marker': {'color': '#ff9900'}
+                             },
+                        ],
+                        'layout': {
+                            'title': {
+                                'text': '热门话题TOP10',
+                                'font': {'size': 50, 'color': 'red', 'family': 'KaiTi'}
+                            },
+                            'plot_bgcolor': 'rgba(0,0,0,0)',
+                            'paper_bgcolor': 'rgba(0,0,0,0)',
+                            'font': {'color': '#fff'},
+                            'yaxis': {'automargin': True, 'dtick': 1, 'tickfont': {'size': 20}},
+                            'xaxis': {'tickfont': {'size': 20}},
+                            'height': 800
+                        }
                     }
-                }
-            )
-        ], style={'backgroundColor': 'rgba(0,0,0,0.5)', 'padding': '20px', 'borderRadius': '5px'}),
+                )
+            ], style={'backgroundColor': 'rgba(0,0,0,0.5)', 'padding': '20px', 'borderRadius': '5px'}),
 
-        html.Div([
-            html.H2("总话题词云图"),
-            html.Img(src=generate_wordcloud_from_db(r'weibo.db'),
-                     style={'width': '100%', 'height': '100%'})
-        ], style={'backgroundColor': 'rgba(0,0,0,0.5)', 'padding': '20px', 'borderRadius': '5px'}),
-    ])
+            html.Div([
+                html.H2("总话题词云图"),
+                html.Img(src=generate_wordcloud_from_db(r'weibo.db'),
+                         style={'width': '100%', 'height': '100%'})
+            ], style={'backgroundColor': 'rgba(0,0,0,0.5)', 'padding': '20px', 'borderRadius': '5px'}),
+        ])
 
     def detail_page_layout(category):
+        import plotly.express as px
+        from plotly.graph_objs import Scatter
+
         time_series_data = generate_time_series_data(r'weibo.db', category)
         sentiment_data = generate_sentiment_data(r'weibo.db', category)
         word_frequency_data = generate_word_frequency_data(r'weibo.db', category)
@@ -403,7 +411,7 @@ def create_dashboard(server):
         if pathname and pathname.startswith("/detail/"):
             selected_category = pathname.split("/")[-1]
             return detail_page_layout(selected_category)
-        return main_page_layout
+        return main_page_layout()
 
     return dash_app
 
@@ -0,0 +1,684 @@
+import argparse
+import itertools
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from replay_server import start_replay_server
+
+
+# 对比多线程爬取、异步爬取与流水线爬取在本地桩服务器上的每秒页数
+def bench_crawl(num_channels=9, num_requests=5, latency=0.05, max_concurrency=8, per_host_concurrency=8):
+    from models import get_Session
+    from spider import multi_async, multi_thread
+    from pipeline import multi_pipeline
+
+    server = start_replay_server(latency=latency)
+    urls = [f"{server.base_url}/ajax/feed/hottimeline?group_id={i}&containerid={i}" for i in range(num_channels)]
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for mode in ['thread', 'async', 'pipeline']:
+            Session = get_Session(os.path.join(tmp_dir, f'bench_{mode}.db'))
+            server.hits = 0
+            time_start = time.time()
+            if mode == 'thread':
+                multi_thread(Session, urls, num_requests)
+            elif mode == 'async':
+                multi_async(Session, urls, num_requests, max_concurrency, per_host_concurrency)
+            else:
+                multi_pipeline(Session, urls, num_requests, max_concurrency)
+            elapsed = time.time() - time_start
+            results[mode] = server.hits / elapsed
+            Session.kw['bind'].dispose()
+    server.shutdown()
+
+    for mode, pages_per_sec in results.items():
+        print(f"{mode}: {pages_per_sec:.1f} pages/sec")
+    return results
+
+
+# 在本地回放服务器上运行完整的multi_spider，统计爬取吞吐与入库延迟
+def bench_replay(fixture_dir=None, mode='thread', num_requests=5, latency=0.0, error_rate=0.0, commit_every=1,
+                 adaptive=False):
+    from models import get_Session
+    from spider import multi_spider, ingest_stats, reset_ingest_stats
+
+    server = start_replay_server(fixture_dir, latency, error_rate)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        Session = get_Session(os.path.join(tmp_dir, 'bench_replay.db'))
+        reset_ingest_stats()
+        time_start = time.time()
+        multi_spider(Session, num_requests, mode=mode, commit_every=commit_every, base_url=server.base_url,
+                     adaptive=adaptive)
+        elapsed = time.time() - time_start
+        Session.kw['bind'].dispose()
+    server.shutdown()
+
+    pages = ingest_stats['pages']
+    result = {
+        'requests_per_sec': server.hits / elapsed,
+        'posts_per_sec': ingest_stats['posts'] / ingest_stats['seconds'] if ingest_stats['seconds'] else 0.0,
+        'ingest_ms_per_page': ingest_stats['seconds'] / pages * 1000 if pages else 0.0,
+    }
+    print(f"{mode}: {server.hits}次请求, {pages}页入库, 用时{elapsed:.2f}s")
+    for name, value in result.items():
+        print(f"{name}: {value:.2f}")
+    return result
+
+
+# 在新的解释器中执行代码并返回耗时（秒）
+def time_subprocess(code):
+    script = f"import time\nt = time.perf_counter()\n{code}\nprint(time.perf_counter() - t)"
+    output = subprocess.run([sys.executable, '-c', script], cwd=os.path.dirname(os.path.abspath(__file__)),
+                            capture_output=True, text=True, check=True).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+# 启动耗时对比：情感词典从xlsx解析（无缓存）与从编译缓存加载。app不导入topic_emotion
+def bench_startup(repeat=3):
+    from topic_emotion import EMOTION_CACHE_PATH
+
+    targets = {
+        'topic_emotion': "import topic_emotion\ntopic_emotion.analyze_sentiment(['开心'])",
+        'db_job': "import db_job\nimport topic_emotion\ntopic_emotion.analyze_sentiment(['开心'])",
+        'app': "import app",
+    }
+    results = {}
+    for name, code in targets.items():
+        cold, warm = [], []
+        for _ in range(repeat):
+            if os.path.exists(EMOTION_CACHE_PATH):
+                os.remove(EMOTION_CACHE_PATH)
+            cold.append(time_subprocess(code))
+            warm.append(time_subprocess(code))
+        results[name] = (min(cold), min(warm))
+        print(f"{name}: xlsx {min(cold):.3f}s, 编译缓存 {min(warm):.3f}s")
+    return results
+
+
+# 启动时不应导入的重量级依赖，只在首次使用时导入
+HEAVY_MODULES = ['torch', 'transformers', 'sklearn', 'scipy', 'pandas', 'plotly.express', 'wordcloud']
+
+
+# 用 python -X importtime 统计导入某模块的耗时：总耗时、入口模块直接导入中最慢的几个，以及被导入的重量级依赖
+def bench_importtime(modules=('app', 'db_job'), top=10):
+    results = {}
+    for module in modules:
+        process = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                                 cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True)
+        if process.returncode:
+            print(f"{module}: 导入失败\n{process.stderr.strip().splitlines()[-1]}")
+            continue
+
+        imports = []
+        for line in process.stderr.splitlines():
+            if not line.startswith('import time:') or 'cumulative' in line:
+                continue
+            _, cumulative, name = line[len('import time:'):].split('|')
+            imports.append((name.rstrip(), int(cumulative)))
+        # importtime输出中每层嵌套缩进两个空格，顶层为导入的入口模块本身，第二层为它直接导入的模块
+        top_level = [(name, cumulative) for name, cumulative in imports if not name.startswith('  ')]
+        direct = [(name, cumulative) for name, cumulative in imports
+                  if name.startswith('   ') and not name.startswith('     ')]
+        imported = {name.strip() for name, _ in imports}
+        heavy = [name for name in HEAVY_MODULES if name in imported]
+
+        total = sum(cumulative for _, cumulative in top_level) / 1e6
+        results[module] = {'seconds': total, 'heavy': heavy}
+        print(f"{module}: 导入用时{total:.3f}s, 重量级依赖: {', '.join(heavy) or '无'}")
+        for name, cumulative in sorted(direct, key=lambda item: item[1], reverse=True)[:top]:
+            print(f"  {cumulative / 1e6:.3f}s {name.strip()}")
+    return results
+
+
+# 合成博文语料：随机混合情感词与普通词语
+def synthetic_texts(num_posts, seed=0):
+    from topic_emotion import get_emotion_table
+
+    rng = random.Random(seed)
+    emotion_words = [word for word in get_emotion_table()['words'] if isinstance(word, str)]
+    filler_words = ['今天', '我们', '的', '了', '大家', '天气', '真的', '觉得', '这个', '事情', '微博', '一起', '，', '。']
+    return [''.join(rng.choice(emotion_words) if rng.random() < 0.15 else rng.choice(filler_words)
+                    for _ in range(rng.randint(10, 60)))
+            for _ in range(num_posts)]
+
+
+# 向临时数据库写入num_posts条合成博文，每条博文随机关联topics_per_post个话题
+def populate_posts(Session, num_posts, topics_per_post=1, num_topics=100, seed=0, hours=71):
+    from collections import Counter
+    from datetime import datetime, timedelta
+    from models import BlogPost, Topic, TopicPost, ensure_post_partitions
+
+    rng = random.Random(seed)
+    now = datetime.now()
+    db_session = Session()
+    ensure_post_partitions(db_session, [now - timedelta(hours=hour) for hour in range(hours + 1)])
+    topic_posts = {(f'topic-{rng.randrange(num_topics)}', i + 1)
+                   for i in range(num_posts) for _ in range(topics_per_post)}
+    post_counts = Counter(topic_uuid for topic_uuid, _ in topic_posts)
+    db_session.bulk_insert_mappings(Topic, [{'uuid': topic_uuid, 'topic_title': topic_uuid, 'post_count': post_count}
+                                            for topic_uuid, post_count in post_counts.items()])
+    db_session.bulk_insert_mappings(TopicPost, [{'topic_uuid': topic_uuid, 'post_id': post_id}
+                                                for topic_uuid, post_id in topic_posts])
+    db_session.bulk_insert_mappings(BlogPost, [{
+        'id': i + 1,
+        'username': f'user{i % 100}',
+        'text': text,
+        'date': now - timedelta(minutes=rng.randint(0, hours * 60)),
+        'reposts_count': rng.randint(0, 100),
+        'comments_count': rng.randint(0, 100),
+        'likes_count': rng.randint(0, 1000),
+        'keywords': [],
+        'emotion': {}
+    } for i, text in enumerate(synthetic_texts(num_posts, seed))])
+    db_session.commit()
+    db_session.close()
+
+
+# 批量重新计算情感：逐条 analyze_sentiment + 逐条更新 与 稀疏矩阵批量计算 + 批量写回 的对比
+def bench_rescore(num_posts=20000):
+    import jieba
+    from models import BlogPost, get_Session, update_posts
+    from topic_emotion import analyze_sentiment, rescore_emotions, get_emotion_table
+
+    jieba.initialize()
+    get_emotion_table()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        Session = get_Session(os.path.join(tmp_dir, 'bench_rescore.db'))
+        populate_posts(Session, num_posts)
+
+        db_session = Session()
+        time_start = time.time()
+        for post in db_session.query(BlogPost).all():
+            update_posts(db_session, [{'id': post.id, 'emotion': analyze_sentiment(list(jieba.cut(post.text)))}])
+        db_session.commit()
+        per_post_seconds = time.time() - time_start
+        db_session.close()
+
+        # 第一次批量计算时分词缓存为空，需要先分词；第二次直接读取分词缓存
+        db_session = Session()
+        time_start = time.time()
+        rescore_emotions(db_session, update_topics=False)
+        cold_seconds = time.time() - time_start
+        time_start = time.time()
+        rescore_emotions(db_session, update_topics=False)
+        warm_seconds = time.time() - time_start
+        db_session.close()
+        Session.kw['bind'].dispose()
+
+    print(f"逐条计算: {per_post_seconds:.2f}s, 批量计算: 分词缓存为空 {cold_seconds:.2f}s, "
+          f"读取分词缓存 {warm_seconds:.2f}s")
+    return per_post_seconds, cold_seconds, warm_seconds
+
+
+# 基线实现：对所有话题逐个话题、逐个字段查询博文，计算 post_count、avg_*、emotion、post_keywords、hot_rate 和 hot_rate_per_hr
+def baseline_topic_stats(db_session, now):
+    from data_analysis import calculate_average_comments_count, calculate_average_likes_count, \
+        calculate_average_reposts_count
+    from db_operations import update_topic_post_keywords, update_topics_post_count
+    from models import Topic
+    from topic_emotion import calculate_average_emotions
+    from topic_hot_rate import update_topics_hot_rate
+    from topic_stage import update_topic_hot_rate_per_hr
+
+    update_topics_post_count(db_session)
+    topic_uuids = [row[0] for row in db_session.query(Topic.uuid)]
+    for topic in db_session.query(Topic):
+        topic.avg_likes = calculate_average_likes_count(db_session, topic.uuid)
+        topic.avg_reposts = calculate_average_reposts_count(db_session, topic.uuid)
+        topic.avg_comments = calculate_average_comments_count(db_session, topic.uuid)
+        topic.emotion = calculate_average_emotions(db_session, topic.uuid)
+    db_session.commit()
+    for topic_uuid in topic_uuids:
+        update_topic_post_keywords(db_session, topic_uuid)
+    update_topics_hot_rate(db_session)
+    for topic_uuid in topic_uuids:
+        update_topic_hot_rate_per_hr(db_session, topic_uuid, now)
+
+
+# 话题统计对比：逐个话题、逐个字段查询博文的旧流程 与 一遍聚合并批量写回的 update_topics_aggregates，并检查两者结果一致
+def bench_aggregate(num_posts=20000, num_topics=500, topics_per_post=2):
+    import shutil
+    from datetime import datetime
+    from models import Topic, get_Session
+    from text_analysis import extract_post_keywords_idf
+    from topic_aggregates import update_topics_aggregates
+    from topic_emotion import rescore_emotions
+
+    fields = ['post_count', 'avg_likes', 'avg_comments', 'avg_reposts', 'emotion', 'post_keywords', 'hot_rate',
+              'hot_rate_per_hr']
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        Session = get_Session(os.path.join(tmp_dir, 'bench_aggregate.db'))
+        populate_posts(Session, num_posts, topics_per_post, num_topics)
+        db_session = Session()
+        rescore_emotions(db_session, update_topics=False)
+        extract_post_keywords_idf(db_session)
+        db_session.close()
+        Session.kw['bind'].dispose()
+        shutil.copy(os.path.join(tmp_dir, 'bench_aggregate.db'), os.path.join(tmp_dir, 'bench_aggregate_old.db'))
+
+        SessionOld = get_Session(os.path.join(tmp_dir, 'bench_aggregate_old.db'))
+        db_session = SessionOld()
+        now = datetime.now()
+        time_start = time.time()
+        baseline_topic_stats(db_session, now)
+        old_seconds = time.time() - time_start
+        old = {topic.uuid: {field: getattr(topic, field) for field in fields} for topic in db_session.query(Topic)}
+        db_session.close()
+        SessionOld.kw['bind'].dispose()
+
+        Session = get_Session(os.path.join(tmp_dir, 'bench_aggregate.db'))
+        db_session = Session()
+        time_start = time.time()
+        update_topics_aggregates(db_session, now)
+        new_seconds = time.time() - time_start
+        new = {topic.uuid: {field: getattr(topic, field) for field in fields} for topic in db_session.query(Topic)}
+        db_session.close()
+        Session.kw['bind'].dispose()
+
+    mismatches = [(uuid, field) for uuid in old for field in fields
+                  if not same_value(old[uuid][field], new[uuid][field])]
+    print(f"逐个话题查询: {old_seconds:.2f}s, 一遍聚合: {new_seconds:.2f}s ({old_seconds / new_seconds:.1f}x)")
+    print(f"不一致的字段: {len(mismatches)}/{len(old) * len(fields)}", mismatches[:5])
+    return old_seconds, new_seconds, mismatches
+
+
+# 生成话题关键词：关键词按长尾分布抽取（第i个词的权重为 1/(i+10)），每个话题5个不重复的关键词；约dup_rate的话题是之前某个话题换掉一个关键词的近似重复
+def synthetic_topic_keywords(num_topics, seed=0, vocab_size=50000, dup_rate=0.1):
+    rng = random.Random(seed)
+    vocabulary = [f'词{i}' for i in range(vocab_size)]
+    cum_weights = list(itertools.accumulate(1 / (i + 10) for i in range(vocab_size)))
+    topics = []
+    for _ in range(num_topics):
+        if topics and rng.random() < dup_rate:
+            keywords = list(rng.choice(topics))
+            keywords[rng.randrange(len(keywords))] = rng.choice(vocabulary)
+        else:
+            keywords = []
+            while len(keywords) < 5:
+                keyword = rng.choices(vocabulary, cum_weights=cum_weights)[0]
+                if keyword not in keywords:
+                    keywords.append(keyword)
+        topics.append(keywords)
+    return topics
+
+
+# BERT话题分类的CPU推理：模型加载和标签编码的耗时（原来每次预测都要重复），以及逐条推理（原来的batch_size=1，
+# 不经过队列）、一次提交全部文本由服务组批、clients个线程并发submit由服务动态组批三种方式的吞吐和延迟。
+# pretrained可以是本地的模型目录
+def bench_bert(num_texts=512, num_labels=200, clients=16, max_batch_size=32, max_wait=0.01,
+               pretrained='bert-base-chinese'):
+    import threading
+    from machine_learning import TopicClassifierService
+
+    model_path = 'bert_model.pth' if os.path.exists('bert_model.pth') else None
+    texts = [" ".join(keywords) for keywords in synthetic_topic_keywords(num_texts, seed=1)]
+    labels = [" ".join(keywords) for keywords in synthetic_topic_keywords(num_labels)]
+
+    time_start = time.time()
+    service = TopicClassifierService(model_path, pretrained, max_batch_size=max_batch_size, max_wait=max_wait)
+    load_seconds = time.time() - time_start
+    time_start = time.time()
+    service.labels_matrix(labels)
+    labels_seconds = time.time() - time_start
+    time_start = time.time()
+    service.labels_matrix(labels)
+    cached_labels_seconds = time.time() - time_start
+
+    latencies = {'逐条推理': [], '动态组批': []}
+    time_start = time.time()
+    for text in texts:
+        request_start = time.time()
+        service.encode([text])
+        latencies['逐条推理'].append(time.time() - request_start)
+    single_seconds = time.time() - time_start
+
+    time_start = time.time()
+    service.embed(texts)
+    batch_seconds = time.time() - time_start
+
+    lock = threading.Lock()
+
+    def client(client_texts):
+        for text in client_texts:
+            request_start = time.time()
+            service.submit(text).result()
+            with lock:
+                latencies['动态组批'].append(time.time() - request_start)
+
+    threads = [threading.Thread(target=client, args=(texts[i::clients],)) for i in range(clients)]
+    time_start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    dynamic_seconds = time.time() - time_start
+    service.close()
+
+    print(f"加载模型{load_seconds:.2f}s, 编码{num_labels}个标签{labels_seconds:.2f}s (缓存后{cached_labels_seconds:.4f}s)")
+    for name, seconds in (('逐条推理', single_seconds), ('批量推理', batch_seconds), ('动态组批', dynamic_seconds)):
+        line = f"{name}: {num_texts / seconds:.1f} texts/sec"
+        if name in latencies:
+            ordered = sorted(latencies[name])
+            line += (f", 延迟p50 {ordered[len(ordered) // 2] * 1000:.1f}ms, "
+                     f"p95 {ordered[int(len(ordered) * 0.95)] * 1000:.1f}ms")
+        print(line)
+    return load_seconds, single_seconds, batch_seconds, dynamic_seconds
+
+
+# 相似度矩阵逐批转为稠密矩阵、argpartition选top_k的暴力检索，作为倒排索引检索的对照。
+# 返回 (博文下标, 话题下标) 集合
+def brute_force_top_topics(post_vectors, topic_vectors, threshold=0.5, top_k=5, batch_cells=1 << 22):
+    import numpy as np
+
+    num_topics = topic_vectors.shape[0]
+    top_k = min(top_k, num_topics)
+    topic_vectors_t = topic_vectors.T.tocsc()
+    batch_size = max(1, batch_cells // num_topics)
+    pairs = set()
+    for offset in range(0, post_vectors.shape[0], batch_size):
+        similarities = (post_vectors[offset:offset + batch_size] @ topic_vectors_t).toarray()
+        top = np.argpartition(-similarities, top_k - 1, axis=1)[:, :top_k]
+        rows, columns = np.nonzero(np.take_along_axis(similarities, top, axis=1) > threshold)
+        pairs.update(zip((rows + offset).tolist(), top[rows, columns].tolist()))
+    return pairs
+
+
+# 话题倒排索引检索：在sizes个话题上比较暴力检索与倒排索引（MaxScore剪枝）检索的耗时，
+# 暴力检索只在前brute_posts条博文上计时并按比例估算，同时以暴力检索为准计算倒排索引的召回率
+def bench_topic_index(sizes=(10000, 100000, 1000000), num_posts=20000, brute_posts=1000, seed=0):
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from topic_index import build_topic_index, search_topic_index
+
+    results = []
+    for num_topics in sizes:
+        rng = random.Random(seed)
+        vocab_size = max(50000, num_topics // 2)
+        topic_keywords = synthetic_topic_keywords(num_topics, seed=seed, vocab_size=vocab_size)
+        noise = synthetic_topic_keywords(num_posts, seed=seed + 1, vocab_size=vocab_size)
+        post_strings = [" ".join(rng.sample(topic_keywords[rng.randrange(num_topics)], rng.randint(1, 5))
+                                 + noise[i][:rng.randint(0, 3)])
+                        for i in range(num_posts)]
+        vectorizer = TfidfVectorizer()
+        topic_vectors = vectorizer.fit_transform([" ".join(keywords) for keywords in topic_keywords])
+        post_vectors = vectorizer.transform(post_strings)
+
+        time_start = time.time()
+        index = build_topic_index(topic_vectors)
+        build_seconds = time.time() - time_start
+        time_start = time.time()
+        post_rows, topic_columns, _ = search_topic_index(index, post_vectors, 0.5, 5)
+        index_seconds = time.time() - time_start
+        time_start = time.time()
+        brute = brute_force_top_topics(post_vectors[:brute_posts], topic_vectors)
+        brute_seconds = (time.time() - time_start) * num_posts / brute_posts
+
+        found = {(post_index, topic_index) for post_index, topic_index in zip(post_rows.tolist(), topic_columns.tolist())
+                 if post_index < brute_posts}
+        recall = len(brute & found) / len(brute) if brute else 1.0
+        print(f"{num_topics}个话题, {num_posts}条博文: 暴力检索约{brute_seconds:.2f}s (按{brute_posts}条估算), "
+              f"倒排索引{index_seconds:.2f}s (建索引{build_seconds:.2f}s, "
+              f"{num_posts / index_seconds:.0f} posts/sec), 召回率{recall:.4f} ({len(brute & found)}/{len(brute)})")
+        results.append((num_topics, brute_seconds, index_seconds, recall))
+    return results
+
+
+# 话题矩阵缓存：冷启动拟合、话题不变时读取缓存、替换changed比例的话题后增量更新三种情况的耗时，
+# 并比较增量更新后的缓存与重新拟合在num_posts条博文上的匹配结果
+def bench_topic_vectors(num_topics=100000, changed=0.01, num_posts=20000, seed=0):
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from topic_index import build_topic_index
+    from topic_recognition import match_keyword_strings
+    from topic_vectors import load_topic_vectors
+
+    rng = random.Random(seed)
+    keyword_lists = synthetic_topic_keywords(num_topics, seed=seed)
+    topic_strings = {f'topic-{i}': " ".join(keywords) for i, keywords in enumerate(keyword_lists)}
+    replacements = synthetic_topic_keywords(int(num_topics * changed), seed=seed + 1)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'bench.topic_vectors.pkl')
+        timings = {}
+        time_start = time.time()
+        load_topic_vectors(topic_strings, path)
+        timings['冷启动拟合'] = time.time() - time_start
+        time_start = time.time()
+        load_topic_vectors(topic_strings, path)
+        timings['话题不变'] = time.time() - time_start
+
+        # 合并掉一部分话题，再加入同样数量的新话题
+        for uuid in rng.sample(sorted(topic_strings), len(replacements)):
+            del topic_strings[uuid]
+        topic_strings.update((f'new-{i}', " ".join(keywords)) for i, keywords in enumerate(replacements))
+        time_start = time.time()
+        vectorizer, topic_index, uuids = load_topic_vectors(topic_strings, path)
+        timings[f'替换{len(replacements)}个话题'] = time.time() - time_start
+
+    keywords_by_uuid = {uuid: string.split() for uuid, string in topic_strings.items()}
+    post_strings = [" ".join(rng.sample(keywords_by_uuid[uuid], rng.randint(1, 5)))
+                    for uuid in rng.choices(sorted(topic_strings), k=num_posts)]
+    cached = {(post_index, uuids[topic_index]) for post_index, topic_index in match_keyword_strings(
+        vectorizer, topic_index, [keywords_by_uuid[uuid] for uuid in uuids], post_strings)}
+    fresh_uuids = list(topic_strings)
+    fresh_vectorizer = TfidfVectorizer()
+    fresh_vectors = fresh_vectorizer.fit_transform([topic_strings[uuid] for uuid in fresh_uuids])
+    fresh = {(post_index, fresh_uuids[topic_index]) for post_index, topic_index in match_keyword_strings(
+        fresh_vectorizer, build_topic_index(fresh_vectors), [keywords_by_uuid[uuid] for uuid in fresh_uuids],
+        post_strings)}
+    print(f"{num_topics}个话题: " + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in timings.items()))
+    print(f"增量缓存与重新拟合的匹配结果: 共同{len(cached & fresh)}条, 仅缓存{len(cached - fresh)}条, "
+          f"仅重新拟合{len(fresh - cached)}条")
+    return timings
+
+
+# 话题合并：原来每500个话题一批两两比较，与倒排索引候选对 + 并查集在全部话题上合并的对比。
+# 在num_topics个话题上与全部两两比较的结果核对（候选对不应漏掉相似话题），再统计scale_topics个话题的合并耗时
+def bench_merge(num_topics=2000, scale_topics=100000, batch_size=500):
+    from data_preprocessing import candidate_topic_pairs, is_similar_keywords, plan_topic_merges
+
+    keyword_lists = synthetic_topic_keywords(num_topics)
+    time_start = time.time()
+    batch_pairs = {(i, j) for offset in range(0, num_topics, batch_size)
+                   for i in range(offset, min(offset + batch_size, num_topics))
+                   for j in range(i + 1, min(offset + batch_size, num_topics))
+                   if is_similar_keywords(keyword_lists[i], keyword_lists[j])}
+    batch_seconds = time.time() - time_start
+    all_pairs = {(i, j) for i in range(num_topics) for j in range(i + 1, num_topics)
+                 if is_similar_keywords(keyword_lists[i], keyword_lists[j])}
+    time_start = time.time()
+    candidates = list(candidate_topic_pairs(keyword_lists))
+    found_pairs = {(min(i, j), max(i, j)) for i, j in candidates
+                   if is_similar_keywords(keyword_lists[i], keyword_lists[j])}
+    index_seconds = time.time() - time_start
+    print(f"{num_topics}个话题: 相似话题对{len(all_pairs)}个, 分批两两比较找到{len(batch_pairs)}个 ({batch_seconds:.2f}s), "
+          f"倒排索引找到{len(found_pairs)}个 ({index_seconds:.3f}s, 候选对{len(candidates)}个), "
+          f"遗漏{len(all_pairs - found_pairs)}个")
+
+    topics = [(str(i), keywords, 1) for i, keywords in enumerate(synthetic_topic_keywords(scale_topics, seed=1))]
+    time_start = time.time()
+    remap = plan_topic_merges(topics)
+    print(f"{scale_topics}个话题: 合并{len(remap)}个话题到{len(set(remap.values()))}个话题, 用时{time.time() - time_start:.2f}s")
+    return all_pairs - found_pairs
+
+
+# 博文与话题匹配：原来逐条博文 transform + cosine_similarity + argsort 与批量稀疏矩阵乘法 + argpartition 的对比。
+# 逐条匹配太慢，只在前old_posts条博文上计时并按比例估算，同时核对两者匹配结果一致
+def bench_match(num_posts=100000, num_topics=2000, old_posts=2000, seed=0):
+    import numpy as np
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.metrics.pairwise import cosine_similarity
+    from topic_index import build_topic_index
+    from topic_recognition import match_keyword_strings
+
+    rng = random.Random(seed)
+    topic_keywords = synthetic_topic_keywords(num_topics, seed=seed)
+    noise = synthetic_topic_keywords(num_posts, seed=seed + 1)
+    post_strings = [" ".join(rng.sample(topic_keywords[rng.randrange(num_topics)], rng.randint(1, 5))
+                             + noise[i][:rng.randint(0, 5)])
+                    for i in range(num_posts)]
+    vectorizer = TfidfVectorizer()
+    topic_vectors = vectorizer.fit_transform([" ".join(keywords) for keywords in topic_keywords])
+
+    time_start = time.time()
+    old_matches = []
+    for post_index, keywords_str in enumerate(post_strings[:old_posts]):
+        similarities = cosine_similarity(vectorizer.transform([keywords_str]), topic_vectors).flatten()
+        for i in np.argsort(similarities)[-5:][::-1]:
+            if similarities[i] > 0.5 and any(kw in keywords_str for kw in topic_keywords[i]):
+                old_matches.append((post_index, i))
+    old_seconds = (time.time() - time_start) * num_posts / old_posts
+
+    # 倒排索引随话题矩阵缓存，不计入匹配耗时
+    topic_index = build_topic_index(topic_vectors)
+    time_start = time.time()
+    matches = match_keyword_strings(vectorizer, topic_index, topic_keywords, post_strings)
+    new_seconds = time.time() - time_start
+    new_matches = [(post_index, topic_index) for post_index, topic_index in matches if post_index < old_posts]
+    print(f"{num_posts}条博文, {num_topics}个话题: 逐条匹配约{old_seconds:.1f}s (按{old_posts}条估算), "
+          f"批量匹配{new_seconds:.2f}s, 匹配{len(matches)}条关联")
+    print(f"前{old_posts}条博文匹配结果一致: {set(old_matches) == set(new_matches)} "
+          f"({len(old_matches)} / {len(new_matches)})")
+    return old_seconds, new_seconds
+
+
+# 比较两次计算的话题字段，浮点数允许累加顺序不同带来的误差
+def same_value(a, b):
+    if isinstance(a, float) or isinstance(b, float):
+        return abs(a - b) <= 1e-9 * max(1.0, abs(a))
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(same_value(a[key], b[key]) for key in a)
+    if isinstance(a, list) and isinstance(b, list):
+        return len(a) == len(b) and all(same_value(x, y) for x, y in zip(a, b))
+    return a == b
+
+
+# 批量清理过期博文：生成hours小时内的博文（超出72小时的部分即待清理的博文），统计清理速度，
+# 并检查增量扣减后的话题统计与从头重建的结果一致
+def bench_expire(num_posts=40000, num_topics=500, topics_per_post=2, hours=96):
+    from datetime import datetime, timedelta
+    from models import Topic, get_Session
+    from db_operations import expire_blogposts
+    from text_analysis import extract_post_keywords_idf
+    from topic_aggregates import rebuild_topic_stats
+    from topic_emotion import rescore_emotions
+
+    fields = ['post_count', 'likes_sum', 'comments_sum', 'reposts_sum', 'emotion_sums', 'avg_likes', 'avg_comments',
+              'avg_reposts', 'emotion', 'post_keywords']
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        Session = get_Session(os.path.join(tmp_dir, 'bench_expire.db'))
+        populate_posts(Session, num_posts, topics_per_post, num_topics, hours=hours)
+        db_session = Session()
+        rescore_emotions(db_session, hours=hours, update_topics=False)
+        extract_post_keywords_idf(db_session)
+        rebuild_topic_stats(db_session)
+
+        time_start = time.time()
+        count = expire_blogposts(db_session, datetime.now() - timedelta(hours=72))
+        seconds = time.time() - time_start
+        incremental = {topic.uuid: {field: getattr(topic, field) for field in fields}
+                       for topic in db_session.query(Topic)}
+        rebuild_topic_stats(db_session)
+        rebuilt = {topic.uuid: {field: getattr(topic, field) for field in fields} for topic in db_session.query(Topic)}
+        db_session.close()
+        Session.kw['bind'].dispose()
+
+    mismatches = [(uuid, field) for uuid in rebuilt for field in fields
+                  if not same_value(incremental[uuid][field], rebuilt[uuid][field])]
+    print(f"清理{count}条过期博文: {seconds:.3f}s ({count / max(seconds, 1e-9):.0f} rows/sec)")
+    print(f"不一致的字段: {len(mismatches)}/{len(rebuilt) * len(fields)}", mismatches[:5])
+    return count, seconds, mismatches
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    crawl_parser = subparsers.add_parser('crawl', help='多线程、异步与流水线爬取的吞吐对比')
+    crawl_parser.add_argument('--channels', type=int, default=9)
+    crawl_parser.add_argument('--requests', type=int, default=5)
+    crawl_parser.add_argument('--latency', type=float, default=0.05)
+    crawl_parser.add_argument('--concurrency', type=int, default=8)
+    crawl_parser.add_argument('--per-host', type=int, default=8)
+
+    replay_parser = subparsers.add_parser('replay', help='在本地回放服务器上运行multi_spider')
+    replay_parser.add_argument('--dir', default=None, help='录制数据目录，为空时使用合成数据')
+    replay_parser.add_argument('--mode', choices=['thread', 'async', 'pipeline'], default='thread')
+    replay_parser.add_argument('--requests', type=int, default=5)
+    replay_parser.add_argument('--latency', type=float, default=0.0)
+    replay_parser.add_argument('--error-rate', type=float, default=0.0)
+    replay_parser.add_argument('--commit-every', type=int, default=1)
+    replay_parser.add_argument('--adaptive', action='store_true', help='使用自适应频道调度')
+
+    startup_parser = subparsers.add_parser('startup', help='情感词典编译缓存前后的启动耗时')
+    startup_parser.add_argument('--repeat', type=int, default=3)
+
+    importtime_parser = subparsers.add_parser('importtime', help='python -X importtime 统计入口模块的导入耗时')
+    importtime_parser.add_argument('modules', nargs='*', default=['app', 'db_job'])
+    importtime_parser.add_argument('--top', type=int, default=10)
+
+    rescore_parser = subparsers.add_parser('rescore', help='逐条与批量重新计算情感的对比')
+    rescore_parser.add_argument('--posts', type=int, default=20000)
+
+    aggregate_parser = subparsers.add_parser('aggregate', help='逐个话题查询与一遍聚合计算话题统计的对比')
+    aggregate_parser.add_argument('--posts', type=int, default=20000)
+    aggregate_parser.add_argument('--topics', type=int, default=500)
+    aggregate_parser.add_argument('--topics-per-post', type=int, default=2)
+
+    match_parser = subparsers.add_parser('match', help='逐条匹配与批量匹配博文话题的对比')
+    match_parser.add_argument('--posts', type=int, default=100000)
+    match_parser.add_argument('--topics', type=int, default=2000)
+
+    bert_parser = subparsers.add_parser('bert', help='BERT话题分类的逐条、批量与动态组批CPU推理对比')
+    bert_parser.add_argument('--texts', type=int, default=512)
+    bert_parser.add_argument('--labels', type=int, default=200)
+    bert_parser.add_argument('--clients', type=int, default=16)
+    bert_parser.add_argument('--max-batch-size', type=int, default=32)
+    bert_parser.add_argument('--max-wait', type=float, default=0.01)
+    bert_parser.add_argument('--pretrained', default='bert-base-chinese')
+
+    index_parser = subparsers.add_parser('index', help='暴力检索与话题倒排索引检索的耗时和召回率')
+    index_parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    index_parser.add_argument('--posts', type=int, default=20000)
+
+    vectors_parser = subparsers.add_parser('vectors', help='话题矩阵缓存的冷启动、命中与增量更新耗时')
+    vectors_parser.add_argument('--topics', type=int, default=100000)
+    vectors_parser.add_argument('--changed', type=float, default=0.01)
+
+    merge_parser = subparsers.add_parser('merge', help='分批两两比较与倒排索引合并话题的对比')
+    merge_parser.add_argument('--topics', type=int, default=2000)
+    merge_parser.add_argument('--scale-topics', type=int, default=100000)
+
+    expire_parser = subparsers.add_parser('expire', help='批量清理过期博文的速度')
+    expire_parser.add_argument('--posts', type=int, default=40000)
+    expire_parser.add_argument('--topics', type=int, default=500)
+    expire_parser.add_argument('--topics-per-post', type=int, default=2)
+    expire_parser.add_argument('--hours', type=int, default=96)
+
+    args = parser.parse_args()
+    if args.command == 'crawl':
+        bench_crawl(args.channels, args.requests, args.latency, args.concurrency, args.per_host)
+    elif args.command == 'replay':
+        bench_replay(args.dir, args.mode, args.requests, args.latency, args.error_rate, args.commit_every,
+                     args.adaptive)
+    elif args.command == 'startup':
+        bench_startup(args.repeat)
+    elif args.command == 'importtime':
+        bench_importtime(args.modules, args.top)
+    elif args.command == 'rescore':
+        bench_rescore(args.posts)
+    elif args.command == 'aggregate':
+        bench_aggregate(args.posts, args.topics, args.topics_per_post)
+    elif args.command == 'match':
+        bench_match(args.posts, args.topics)
+    elif args.command == 'bert':
+        bench_bert(args.texts, args.labels, args.clients, args.max_batch_size, args.max_wait, args.pretrained)
+    elif args.command == 'index':
+        bench_topic_index(args.sizes, args.posts)
+    elif args.command == 'vectors':
+        bench_topic_vectors(args.topics, args.changed)
+    elif args.command == 'merge':
+        bench_merge(args.topics, args.scale_topics)
+    elif args.command == 'expire':
+        bench_expire(args.posts, args.topics, args.topics_per_post, args.hours)
@@ -0,0 +1,94 @@
+import threading
+from datetime import datetime, timedelta
+from models import Channel, load_database
+
+# 新频道（尚无产出记录）的默认产出率，取一页的博文数，保证新频道能被充分探索
+DEFAULT_YIELD = 10.0
+# 平滑系数：新一轮产出率在指数加权平均中的权重
+YIELD_ALPHA = 0.5
+# 每次请求新博文数低于该值视为低产出
+LOW_YIELD = 1.0
+# 低产出或失败频道的退避时间：BASE_BACKOFF * 2^(连续次数-1)，不超过MAX_BACKOFF
+BASE_BACKOFF = timedelta(minutes=10)
+MAX_BACKOFF = timedelta(hours=12)
+
+# 本轮爬取结果：gid -> {'requests': 请求数, 'new_posts': 新博文数, 'failed': 失败次数}，多个爬取线程共享
+crawl_results = {}
+crawl_lock = threading.Lock()
+
+
+# 记录某频道一次请求的结果
+def record_crawl(gid, new_posts=0, failed=False):
+    if gid is None:
+        return
+    with crawl_lock:
+        result = crawl_results.setdefault(gid, {'requests': 0, 'new_posts': 0, 'failed': 0})
+        result['requests'] += 1
+        result['new_posts'] += new_posts
+        result['failed'] += int(failed)
+
+
+# 按产出率分配请求预算：处于退避期的频道不分配，其余频道按产出率加权，每个频道至少min_requests次
+def allocate_requests(channels, budget, now=None, min_requests=1, max_requests=50):
+    now = now or datetime.now()
+    eligible = [channel for channel in channels if not channel.next_crawl_at or channel.next_crawl_at <= now]
+    if not eligible:
+        return {}
+
+    weights = {channel.gid: channel.yield_rate if channel.yield_rate is not None else DEFAULT_YIELD
+               for channel in eligible}
+    total_weight = sum(weights.values())
+    plan = {}
+    for gid, weight in weights.items():
+        share = budget * weight / total_weight if total_weight else budget / len(weights)
+        plan[gid] = max(min_requests, min(max_requests, round(share)))
+    return plan
+
+
+# 用本轮爬取结果更新频道的产出率和退避状态，并清空本轮结果
+def apply_crawl_results(db_session, now=None):
+    now = now or datetime.now()
+    with crawl_lock:
+        results = dict(crawl_results)
+        crawl_results.clear()
+
+    channels = db_session.query(Channel).filter(Channel.gid.in_(list(results))).all() if results else []
+    for channel in channels:
+        result = results[channel.gid]
+        succeeded = result['requests'] - result['failed']
+        current_yield = result['new_posts'] / succeeded if succeeded else 0.0
+        if channel.yield_rate is None:
+            channel.yield_rate = current_yield
+        else:
+            channel.yield_rate = YIELD_ALPHA * current_yield + (1 - YIELD_ALPHA) * channel.yield_rate
+
+        if not succeeded or current_yield < LOW_YIELD:
+            # 低产出或全部失败：指数退避
+            channel.failures = (channel.failures or 0) + 1
+            channel.next_crawl_at = now + min(BASE_BACKOFF * 2 ** (channel.failures - 1), MAX_BACKOFF)
+        else:
+            channel.failures = 0
+            channel.next_crawl_at = None
+    db_session.commit()
+
+
+# 获取所有频道的调度状态，按产出率从高到低排列
+def scheduler_state(db_session):
+    channels = db_session.query(Channel).all()
+    state = [{
+        'title': channel.title,
+        'gid': channel.gid,
+        'yield_rate': channel.yield_rate,
+        'failures': channel.failures or 0,
+        'next_crawl_at': channel.next_crawl_at,
+        'since_id': channel.since_id
+    } for channel in channels]
+    return sorted(state, key=lambda item: item['yield_rate'] if item['yield_rate'] is not None else DEFAULT_YIELD,
+                  reverse=True)
+
+
+if __name__ == '__main__':
+    for item in scheduler_state(load_database()):
+        yield_rate = '-' if item['yield_rate'] is None else f"{item['yield_rate']:.2f}"
+        print(f"{item['title']}\t{item['gid']}\t产出率: {yield_rate}\t连续低产出: {item['failures']}\t"
+              f"下次爬取: {item['next_crawl_at'] or '立即'}")
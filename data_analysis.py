@@ -1,19 +1,20 @@
-from models import BlogPost, Topic
-from sqlalchemy import func, String
+from models import BlogPost, TopicPost
 
-# 获取某个topic的所有相关blogposts
+# 获取某个topic的所有相关blogposts：通过topic_posts关联表的主键索引查找，再按博文主键连接
 def get_blogposts_for_topic(session_db, topic_uuid):
-    topic = session_db.query(Topic).filter_by(uuid=topic_uuid).first()
-    if not topic:
-        return []
-    blogpost_ids = topic.blogposts
-    if not blogpost_ids:
-        return []
-
-    # 将 blogpost_ids 转换为字符串进行查询
-    blogpost_ids_str = [str(id) for id in blogpost_ids]
-    blogposts = session_db.query(BlogPost).filter(func.cast(BlogPost.id, String).in_(blogpost_ids_str)).all()
-    return blogposts
+    return session_db.query(BlogPost).join(TopicPost, TopicPost.post_id == BlogPost.id).filter(
+        TopicPost.topic_uuid == topic_uuid).all()
+
+
+# 获取一批博文各自相关的话题uuid：返回 博文id -> 话题uuid列表
+def get_topics_for_posts(session_db, post_ids):
+    post_ids = list(post_ids)
+    result = {}
+    for offset in range(0, len(post_ids), 500):
+        for topic_uuid, post_id in session_db.query(TopicPost.topic_uuid, TopicPost.post_id).filter(
+                TopicPost.post_id.in_(post_ids[offset:offset + 500])):
+            result.setdefault(post_id, []).append(topic_uuid)
+    return result
 
 def calculate_average_likes_count(session_db, topic_uuid):
     blogposts = get_blogposts_for_topic(session_db, topic_uuid)
@@ -1,79 +1,148 @@
 import math
-from collections import Counter
-from models import Topic, BlogPost, load_database
+from collections import Counter, defaultdict
+from models import Topic, TopicPost, BlogPost
+from topic_aggregates import POST_VALUE_FIELDS, post_values, update_topic_stats
 
-# session_db:从本地加载的数据库会话
-session_db = load_database()
+# 话题关键词的余弦相似度高于该阈值时合并
+MERGE_THRESHOLD = 0.5
 
 
-# 使用余弦相似度算法计算关键词相似度
-def topic_cosine_similarity(list1, list2):
-    if not list1 or not list2:
+# 关键词的词频向量及其模长，批量比较时每个话题只需计算一次
+def keyword_vector(keywords):
+    vec = Counter(keywords or [])
+    return vec, math.sqrt(sum([vec[x] ** 2 for x in vec.keys()]))
+
+
+# 两个关键词词频向量的余弦相似度
+def vector_cosine_similarity(vector1, vector2):
+    (vec1, norm1), (vec2, norm2) = vector1, vector2
+    denominator = norm1 * norm2
+    if not denominator:
         return 0.0
-    vec1 = Counter(list1)
-    vec2 = Counter(list2)
-    intersection = set(vec1.keys()) & set(vec2.keys())
+    intersection = vec1.keys() & vec2.keys()
     numerator = sum([vec1[x] * vec2[x] for x in intersection])
+    return float(numerator) / denominator
 
-    sum1 = sum([vec1[x] ** 2 for x in vec1.keys()])
-    sum2 = sum([vec2[x] ** 2 for x in vec2.keys()])
-    denominator = math.sqrt(sum1) * math.sqrt(sum2)
 
-    if not denominator:
+# 使用余弦相似度算法计算关键词相似度
+def topic_cosine_similarity(list1, list2):
+    if not list1 or not list2:
         return 0.0
-    else:
-        return float(numerator) / denominator
+    return vector_cosine_similarity(keyword_vector(list1), keyword_vector(list2))
 
 
 # 判断相似度是否高于阈值
-def is_similar_keywords(keywords1, keywords2, threshold=0.5):
+def is_similar_keywords(keywords1, keywords2, threshold=MERGE_THRESHOLD):
     similarity = topic_cosine_similarity(keywords1, keywords2)
     return similarity > threshold
 
 
-# 合并相似度高的话题
-def merge_topics(session, batch_size=500):
+# 用关键词倒排索引生成候选话题对（下标对），只比较前缀中有共同关键词的话题（前缀过滤）：
+# 关键词按包含它的话题数从少到多排序，话题按关键词数从少到多处理。n个关键词的话题y与关键词更多的话题x
+# 余弦相似度不低于t时，共同关键词数 o >= t·sqrt(|x|·|y|)，且 o >= t·|y|、o >= t²·|x|，
+# 因此y的前 n - ceil(t·n) + 1 个关键词（索引前缀）与x的前 n - ceil(t²·n) + 1 个关键词（查询前缀）必然相交，
+# 不会漏掉相似的话题（话题关键词由TF-IDF提取，本身不重复）；常见关键词多被排除在前缀之外，候选对远少于两两比较
+def candidate_topic_pairs(keyword_lists, threshold=MERGE_THRESHOLD):
+    keyword_sets = [set(keywords or []) for keywords in keyword_lists]
+    doc_freq = Counter(keyword for keywords in keyword_sets for keyword in keywords)
+    index = defaultdict(list)
+    for i in sorted(range(len(keyword_sets)), key=lambda i: len(keyword_sets[i])):
+        keywords = sorted(keyword_sets[i], key=lambda keyword: (doc_freq[keyword], keyword))
+        probe_length = len(keywords) - math.ceil(threshold * threshold * len(keywords) - 1e-9) + 1
+        index_length = len(keywords) - math.ceil(threshold * len(keywords) - 1e-9) + 1
+        candidates = set()
+        for keyword in keywords[:probe_length]:
+            candidates.update(index.get(keyword, ()))
+        for j in candidates:
+            yield j, i
+        for keyword in keywords[:index_length]:
+            index[keyword].append(i)
+
+
+# 并查集：查找下标i所在组的代表，同时压缩路径
+def find_root(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+# 在全部话题中找出需要合并的话题：topics为 (uuid, keywords, post_count) 列表，
+# 相似的话题用并查集合并成组（已在同一组的候选对不再计算相似度），每组保留博文数最多的话题，
+# 返回 被合并话题uuid -> 保留话题uuid
+def plan_topic_merges(topics, threshold=MERGE_THRESHOLD):
+    parent = list(range(len(topics)))
+    vectors = [keyword_vector(keywords) for _, keywords, _ in topics]
+    for i, j in candidate_topic_pairs([keywords for _, keywords, _ in topics], threshold):
+        root_i, root_j = find_root(parent, i), find_root(parent, j)
+        if root_i != root_j and vector_cosine_similarity(vectors[i], vectors[j]) > threshold:
+            parent[max(root_i, root_j)] = min(root_i, root_j)
+
+    groups = defaultdict(list)
+    for i in range(len(topics)):
+        groups[find_root(parent, i)].append(i)
+    remap = {}
+    for members in groups.values():
+        keep = max(members, key=lambda i: (topics[i][2] or 0, -i))
+        remap.update((topics[i][0], topics[keep][0]) for i in members if i != keep)
+    return remap
+
+
+# 合并相似度高的话题：在全部话题上一次找出合并组，被合并话题的博文转移到保留的话题后删除，在一个事务中完成
+def merge_topics(session, threshold=MERGE_THRESHOLD):
     session=session()
-    offset = 0
-    while True:
-        # 获取一批话题
-        topics_batch = session.query(Topic).offset(offset).limit(batch_size).all()
-        if not topics_batch:
-            break
-
-        topics_dict = {topic.uuid: topic for topic in topics_batch}
-        merged = set()
-
-        for uuid1, topic1 in topics_dict.items():
-            if uuid1 in merged:
-                continue
-            for uuid2, topic2 in topics_dict.items():
-                if uuid1 != uuid2 and is_similar_keywords(topic1.keywords, topic2.keywords):
-                    print(f"合并以下两个话题: {topic1.topic_title, topic2.topic_title}")
-                    if topic1.post_count >= topic2.post_count:
-                        topic1.blogposts.extend(topic2.blogposts)
-                        topic1.blogposts = list(set(topic1.blogposts))  # 去重
-                        topic1.post_count = len(topic1.blogposts)
-                        update_blogposts(session, topic2.uuid, topic1.uuid)
-                        session.delete(topic2)
-                    else:
-                        topic2.blogposts.extend(topic1.blogposts)
-                        topic2.blogposts = list(set(topic2.blogposts))  # 去重
-                        topic2.post_count = len(topic2.blogposts)
-                        update_blogposts(session, topic1.uuid, topic2.uuid)
-                        session.delete(topic1)
-                    session.commit()
-                    merged.add(uuid2)
-
-        offset += batch_size
-
-
-# 更新被合并话题相关的博文
-def update_blogposts(session, old_uuid, new_uuid):
-    blogposts = session.query(BlogPost).all()
-    for post in blogposts:
-        if any(topic['uuid'] == old_uuid for topic in post.topics):
-            post.topics = [
-                {'uuid': new_uuid if topic['uuid'] == old_uuid else topic['uuid']}
-                for topic in post.topics]
-            session.commit()
+    topics = session.query(Topic.uuid, Topic.keywords, Topic.post_count).all()
+    remap = plan_topic_merges(topics, threshold)
+    if remap:
+        titles = dict(session.query(Topic.uuid, Topic.topic_title))
+        kept_uuids = list(set(remap.values()))
+        kept_topics = {}
+        for offset in range(0, len(kept_uuids), 500):
+            kept_topics.update((topic.uuid, topic) for topic in session.query(Topic).filter(
+                Topic.uuid.in_(kept_uuids[offset:offset + 500])))
+        for old_uuid, new_uuid in remap.items():
+            print(f"合并以下两个话题: {titles[new_uuid], titles[old_uuid]}")
+        merge_topic_stats(session, kept_topics, update_blogposts(session, remap))
+        merged_uuids = list(remap)
+        for offset in range(0, len(merged_uuids), 500):
+            session.query(Topic).filter(Topic.uuid.in_(merged_uuids[offset:offset + 500])).delete(
+                synchronize_session=False)
+        session.commit()
+    session.close()
+    return len(remap)
+
+
+# 按 被合并话题uuid -> 新话题uuid 一次转移所有被合并话题的博文关联（同一博文在新话题中只保留一条关联）：
+# 通过topic_posts关联表读取涉及的话题的关联，批量插入新关联、删除旧关联。返回 新话题uuid -> 新加入的博文id列表
+def update_blogposts(session, remap):
+    topic_uuids = list(set(remap) | set(remap.values()))
+    links = defaultdict(set)
+    for offset in range(0, len(topic_uuids), 500):
+        for topic_uuid, post_id in session.query(TopicPost.topic_uuid, TopicPost.post_id).filter(
+                TopicPost.topic_uuid.in_(topic_uuids[offset:offset + 500])):
+            links[topic_uuid].add(post_id)
+
+    moved = defaultdict(set)
+    for old_uuid, new_uuid in remap.items():
+        moved[new_uuid].update(links[old_uuid] - links[new_uuid])
+    session.bulk_insert_mappings(TopicPost, [{'topic_uuid': new_uuid, 'post_id': post_id}
+                                             for new_uuid, post_ids in moved.items() for post_id in post_ids])
+    old_uuids = list(remap)
+    for offset in range(0, len(old_uuids), 500):
+        session.query(TopicPost).filter(TopicPost.topic_uuid.in_(old_uuids[offset:offset + 500])).delete(
+            synchronize_session=False)
+    return {new_uuid: list(post_ids) for new_uuid, post_ids in moved.items()}
+
+
+# 将新加入的博文计入合并后话题的博文数和累加统计量：topics为 uuid -> Topic，
+# moved为 uuid -> 新加入的博文id列表，所有博文一次分批读取
+def merge_topic_stats(session, topics, moved):
+    post_ids = list({post_id for post_ids in moved.values() for post_id in post_ids})
+    posts = {}
+    for offset in range(0, len(post_ids), 500):
+        posts.update((post.id, post_values(post)) for post in session.query(
+            BlogPost.id, *[getattr(BlogPost, field) for field in POST_VALUE_FIELDS]).filter(
+            BlogPost.id.in_(post_ids[offset:offset + 500])))
+    for topic_uuid, topic_post_ids in moved.items():
+        update_topic_stats(topics[topic_uuid],
+                           added=[posts[post_id] for post_id in topic_post_ids if post_id in posts])
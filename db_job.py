@@ -1,7 +1,9 @@
 from db_operations import clean_old_blogposts, update_topics_all
 from text_analysis import extract_keywords
-from models import BlogPost, Channel, Weight, Topic
+from models import BlogPost, Channel, Weight, Topic, TopicPost, Token, PostTokens, DocFreq, drop_post_partitions, \
+    ensure_post_partitions
 from models import Session, SessionCopy
+from token_cache import reset_vocabulary
 from spider import multi_spider
 from data_preprocessing import merge_topics
 
@@ -31,15 +33,20 @@ def copy_database(SessionSrc, SessionDst):
     src_session = SessionSrc()
     dst_session = SessionDst()
 
-    # 清空目标数据库中的数据
-    dst_session.query(BlogPost).delete()
+    # 清空目标数据库中的数据，博文直接删除所有分区
+    drop_post_partitions(dst_session)
     dst_session.query(Channel).delete()
     dst_session.query(Weight).delete()
     dst_session.query(Topic).delete()
+    dst_session.query(TopicPost).delete()
+    dst_session.query(Token).delete()
+    dst_session.query(PostTokens).delete()
+    dst_session.query(DocFreq).delete()
     dst_session.commit()
 
     # 复制BlogPost数据
     blogposts = src_session.query(BlogPost).all()
+    ensure_post_partitions(dst_session, [post.date for post in blogposts])
     for post in blogposts:
         new_post = BlogPost(
             id=post.id,
@@ -49,20 +56,33 @@ def copy_database(SessionSrc, SessionDst):
             reposts_count=post.reposts_count,
             comments_count=post.comments_count,
             likes_count=post.likes_count,
-            topics=post.topics,
             keywords=post.keywords,
             emotion=post.emotion
         )
         dst_session.add(new_post)
     dst_session.commit()
 
+    # 复制词表与博文分词缓存
+    dst_session.bulk_insert_mappings(Token, [{'id': token.id, 'token': token.token}
+                                             for token in src_session.query(Token)])
+    dst_session.bulk_insert_mappings(PostTokens, [{'post_id': post_tokens.post_id, 'tokens': post_tokens.tokens}
+                                                  for post_tokens in src_session.query(PostTokens)])
+    dst_session.bulk_insert_mappings(DocFreq, [{'token_id': doc_freq.token_id, 'doc_freq': doc_freq.doc_freq}
+                                               for doc_freq in src_session.query(DocFreq)])
+    dst_session.commit()
+    reset_vocabulary(dst_session)
+
     # 复制Channel数据
     channels = src_session.query(Channel).all()
     for channel in channels:
         new_channel = Channel(
             title=channel.title,
             gid=channel.gid,
-            containerid=channel.containerid
+            containerid=channel.containerid,
+            since_id=channel.since_id,
+            yield_rate=channel.yield_rate,
+            failures=channel.failures,
+            next_crawl_at=channel.next_crawl_at
         )
         dst_session.add(new_channel)
     dst_session.commit()
@@ -91,20 +111,31 @@ def copy_database(SessionSrc, SessionDst):
             keywords=topic.keywords,
             post_keywords=topic.post_keywords,
             hot_rate=topic.hot_rate,
-            blogposts=topic.blogposts,
             emotion=topic.emotion,
             avg_likes=topic.avg_likes,
             avg_comments=topic.avg_comments,
             avg_reposts=topic.avg_reposts,
-            hot_rate_per_hr=topic.hot_rate_per_hr
+            hot_rate_per_hr=topic.hot_rate_per_hr,
+            hot_rate_per_hr_at=topic.hot_rate_per_hr_at,
+            dirty=topic.dirty,
+            likes_sum=topic.likes_sum,
+            comments_sum=topic.comments_sum,
+            reposts_sum=topic.reposts_sum,
+            emotion_sums=topic.emotion_sums
         )
         dst_session.add(new_topic)
     dst_session.commit()
 
+    # 复制话题与博文的关联
+    dst_session.bulk_insert_mappings(TopicPost, [{'topic_uuid': topic_post.topic_uuid, 'post_id': topic_post.post_id}
+                                                 for topic_post in src_session.query(TopicPost)])
+    dst_session.commit()
+
 
     src_session.close()
     dst_session.close()
     print("成功复制数据库")
 
 
-update()
\ No newline at end of file
+if __name__ == '__main__':
+    update()
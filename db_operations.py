@@ -1,11 +1,13 @@
-from datetime import datetime, timedelta
-from data_analysis import calculate_average_comments_count, calculate_average_reposts_count, \
-    calculate_average_likes_count, get_blogposts_for_topic
-from topic_emotion import update_topics_emotions
-from topic_hot_rate import update_topics_hot_rate
-from models import BlogPost, Topic, load_database
+import time
+from datetime import datetime
+from sqlalchemy import func, select
+from data_analysis import get_blogposts_for_topic
+from models import RETENTION, BlogPost, Topic, TopicPost, drop_post_partitions, load_database, partition_start
+from token_cache import delete_post_tokens
+from topic_aggregates import aggregate_topics, apply_topic_stats, clear_dirty_topics, \
+    rebuild_topic_stats, untracked_topic_uuids, update_topics_hot_rates
 from topic_recognition import match_topics_to_blogposts
-from topic_stage import update_topics_hot_rate_per_hr, update_topics_stage
+from topic_stage import update_topics_stage
 
 
 def display_posts(session):
@@ -40,42 +42,57 @@ def display_data():
     display_topics(session)
 
 
-# 删除超过 72 小时的 BlogPost 并更新或删除相应的 Topic
-def clean_old_blogposts(session):
-    session=session()
-    three_days_ago = datetime.now() - timedelta(hours=72)
-
-    old_posts = session.query(BlogPost).filter(BlogPost.date < three_days_ago).all()
-    for post in old_posts:
-        topics = post.topics
-        for topic in topics:
-            topic_uuid = topic['uuid']
-            existing_topic = session.query(Topic).filter_by(uuid=topic_uuid).first()
-            if existing_topic:
-                # 减少 post_count 并从 blogposts 列表中删除该 post 的 id
-                existing_topic.post_count -= 1
-                existing_topic.blogposts = [bp_id for bp_id in existing_topic.blogposts if bp_id != post.id]
-
-                # 如果 post_count 为 0，则删除该 Topic
-                if existing_topic.post_count == 0:
-                    session.delete(existing_topic)
-                session.commit()
-
-        # 删除 BlogPost
-        session.delete(post)
-        session.commit()
+# 批量删除cutoff之前发布的BlogPost，在一个事务中用少量集合操作完成。博文按分区整张删除，
+# 因此只清理整个分区都早于cutoff的博文（博文最多比保留时长多保留一个分区的时长）：
+# 一次读取过期博文及其话题关联，按话题汇总后从话题的累加统计量中减去（同时标记为dirty），
+# 删除博文数降为0的Topic，再按条件一次删除话题关联和分词缓存，最后删除过期的分区表。返回删除的博文数
+def expire_blogposts(session_db, cutoff):
+    cutoff = partition_start(cutoff)
+    expired = select(BlogPost.id).where(BlogPost.date < cutoff)
+    post_ids = [row[0] for row in session_db.execute(expired)]
+    if not post_ids:
+        return 0
+
+    removed = aggregate_topics(session_db, post_filter=BlogPost.date < cutoff)
+    empty_topics = []
+    topic_uuids = list(removed)
+    for offset in range(0, len(topic_uuids), 500):
+        for topic in session_db.query(Topic).filter(Topic.uuid.in_(topic_uuids[offset:offset + 500])):
+            apply_topic_stats(topic, removed[topic.uuid], sign=-1)
+            if topic.post_count <= 0:
+                empty_topics.append(topic.uuid)
+    session_db.flush()
+
+    for offset in range(0, len(empty_topics), 500):
+        chunk = empty_topics[offset:offset + 500]
+        session_db.query(TopicPost).filter(TopicPost.topic_uuid.in_(chunk)).delete(synchronize_session=False)
+        session_db.query(Topic).filter(Topic.uuid.in_(chunk)).delete(synchronize_session=False)
+    session_db.query(TopicPost).filter(TopicPost.post_id.in_(expired)).delete(synchronize_session=False)
+    delete_post_tokens(session_db, post_ids)
+    drop_post_partitions(session_db, cutoff)
+    session_db.commit()
+    return len(post_ids)
+
 
+# 删除超过保留时长（默认72小时）的 BlogPost 并更新或删除相应的 Topic
+def clean_old_blogposts(session, retention=RETENTION):
+    session=session()
+    time_start = time.time()
+    count = expire_blogposts(session, datetime.now() - retention)
+    seconds = time.time() - time_start
     session.close()
-    print("成功清理过期数据")
+    print(f"成功清理过期数据: {count}条博文, 用时{seconds:.2f}s ({count / max(seconds, 1e-9):.0f} rows/sec)")
+    return count
 
 
 
 
 # 对所有topic的post_count进行更新
 def update_topics_post_count(session_db):
+    post_counts = dict(session_db.query(TopicPost.topic_uuid, func.count()).group_by(TopicPost.topic_uuid))
     topics = session_db.query(Topic).all()
     for topic in topics:
-        topic.post_count = len(topic.blogposts)
+        topic.post_count = post_counts.get(topic.uuid, 0)
     session_db.commit()
 
 
@@ -100,50 +117,22 @@ def update_topic_post_keywords(session_db, topic_uuid):
     return keyword_freq
 
 
-# 更新所有话题的post_keywords
-def update_topics_post_keywords(session_db):
-
-    topics = session_db.query(Topic).all()
-    for topic in topics:
-        update_topic_post_keywords(session_db, topic.uuid)
-    session_db.commit()
-
-
-# 对所有topic的avg_*字段进行更新
-def update_topics_avgs(session_db):
-    topics = session_db.query(Topic).all()
-    for topic in topics:
-        topic.avg_likes = calculate_average_likes_count(session_db, topic.uuid)
-        topic.avg_reposts = calculate_average_reposts_count(session_db, topic.uuid)
-        topic.avg_comments = calculate_average_comments_count(session_db, topic.uuid)
-    session_db.commit()
-
-
-# 对topic的主要属性进行更新
-def update_topics_attributes(session_db):
-
-    print("写入Topic.avgs...")
-    update_topics_avgs(session_db)
-    print("写入Topic.emotions...")
-    update_topics_emotions(session_db)
-
-
 # 将所有topics内的属性进行更新
 def update_topics_all(session):
     session=session()
 
     print("识别博文主题中...")
     match_topics_to_blogposts(session)
-    print("写入Topic.post_count...")
-    update_topics_post_count(session)
-    update_topics_attributes(session)
-    print("写入Topic.post_keywords...")
-    update_topics_post_keywords(session)
-    print("写入Topic.hot_rate...")
-    update_topics_hot_rate(session)
-    print("写入Topic.hot_rate_per_hr...")
-    update_topics_hot_rate_per_hr(session)
+    # post_count、avg_*、emotion、post_keywords随博文入库、匹配、合并和过期增量维护，
+    # 只有尚未开始维护累加统计量的话题（旧数据库）需要从头重建
+    untracked = untracked_topic_uuids(session)
+    if untracked:
+        print(f"重建{len(untracked)}个话题的累加统计量...")
+        rebuild_topic_stats(session, untracked)
+    print("写入Topic.hot_rate, hot_rate_per_hr...")
+    update_topics_hot_rates(session)
     print("写入Topic.stage...")
     update_topics_stage(session)
+    clear_dirty_topics(session)
 
 
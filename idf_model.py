@@ -0,0 +1,38 @@
+import math
+from sqlalchemy import func
+from models import PostTokens, DocFreq, load_database
+from token_cache import get_vocabulary, load_token_ids, update_doc_freqs
+
+# 语料中的博文数少于该值时，语料IDF不可靠，退回jieba自带的通用IDF
+MIN_DOCS = 1000
+
+
+# 从已缓存的分词结果重建文档频率，用于在已有数据上首次启用语料IDF或修复不一致
+def rebuild_doc_freqs(session_db):
+    session_db.query(DocFreq).delete()
+    post_ids = [row[0] for row in session_db.query(PostTokens.post_id)]
+    update_doc_freqs(session_db, load_token_ids(session_db, post_ids).values())
+    session_db.commit()
+    return len(post_ids)
+
+
+# 加载语料IDF模型：idf = log(N / df)，与jieba的IDF表尺度相同；博文数少于min_docs时返回None
+# 文档频率在博文分词缓存写入和删除时同步增减，因此N直接取博文分词缓存的行数
+def load_idf_model(session_db, min_docs=MIN_DOCS):
+    doc_count = session_db.query(func.count(PostTokens.post_id)).scalar()
+    if doc_count < min_docs:
+        return None
+
+    tokens = get_vocabulary(session_db)['tokens']
+    idf = {tokens[token_id]: math.log(doc_count / doc_freq)
+           for token_id, doc_freq in session_db.query(DocFreq.token_id, DocFreq.doc_freq).filter(DocFreq.doc_freq > 0)
+           if token_id in tokens}
+    values = sorted(idf.values())
+    return {'idf': idf, 'median_idf': values[len(values) // 2] if values else 0.0, 'doc_count': doc_count}
+
+
+if __name__ == '__main__':
+    session = load_database()
+    print(f"重建文档频率，博文数: {rebuild_doc_freqs(session)}")
+    model = load_idf_model(session, min_docs=0)
+    print(f"词语数: {len(model['idf'])}, IDF中位数: {model['median_idf']:.3f}")
@@ -1,7 +1,11 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
 import torch
 import torch.nn.functional as F
 from torch.utils.data import Dataset, DataLoader
-from transformers import BertTokenizer, BertModel, AdamW
+from transformers import BertTokenizer, BertModel
 
 
 # 自定义数据集
@@ -83,39 +87,6 @@ def train_model(model, data_loader, optimizer, device, scheduler, num_epochs):
         print(f'Epoch {epoch + 1}/{num_epochs}, Loss: {loss.item()}')
 
 
-# 定义预测函数
-def predict(model, data_loader, device, tokenizer, Y):
-    model = model.eval()
-    predictions = []
-    with torch.no_grad():
-        label_encodings = [tokenizer.encode_plus(label, add_special_tokens=True, max_length=48, padding='max_length',
-                                                 return_tensors='pt') for label in Y]
-        label_input_ids = torch.stack([enc['input_ids'].flatten().to(device) for enc in label_encodings])
-        label_attention_mask = torch.stack([enc['attention_mask'].flatten().to(device) for enc in label_encodings])
-        label_outputs = model(
-            input_ids=label_input_ids,
-            attention_mask=label_attention_mask
-        )
-        label_embeddings = label_outputs.last_hidden_state[:, 0, :]
-
-        for batch in data_loader:
-            input_ids = batch['input_ids'].to(device)
-            attention_mask = batch['attention_mask'].to(device)
-
-            outputs = model(
-                input_ids=input_ids,
-                attention_mask=attention_mask
-            )
-
-            embeddings = outputs.last_hidden_state[:, 0, :]
-            cosine_sim = F.cosine_similarity(embeddings.unsqueeze(1), label_embeddings.unsqueeze(0), dim=-1)
-            preds = torch.argmax(cosine_sim, dim=1)
-
-            predictions.extend(preds.cpu().numpy())
-
-    return predictions
-
-
 # 保存模型函数
 def save_model(model, path):
     torch.save(model.state_dict(), path)
@@ -145,7 +116,7 @@ def training(X, Y):
     model = model.to(device)
 
     # 优化器和学习率调度器
-    optimizer = AdamW(model.parameters(), lr=2e-5)
+    optimizer = torch.optim.AdamW(model.parameters(), lr=2e-5)
     total_steps = len(data_loader) * 3  # 假设训练3个epoch
     scheduler = torch.optim.lr_scheduler.StepLR(optimizer, step_size=total_steps // 3, gamma=0.1)
 
@@ -156,27 +127,142 @@ def training(X, Y):
     save_model(model, model_path)
 
 
-# 预测函数
+# 常驻的CPU批量推理服务：模型和分词器只加载一次，标签（话题关键词）的向量按文本缓存，只编码新出现的标签；
+# submit提交的文本由后台线程动态组批：收到第一条后最多等待max_wait秒或凑满max_batch_size条再一起推理，
+# 每批按批内最长文本补齐；所有编码（包括标签）都经过这个队列。model_path为None时只使用预训练权重，
+# pretrained可以是模型名或本地目录
+class TopicClassifierService:
+    def __init__(self, model_path='bert_model.pth', pretrained='bert-base-chinese', max_len=48, max_batch_size=32,
+                 max_wait=0.01):
+        self.device = torch.device("cpu")
+        self.max_len = max_len
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.tokenizer = BertTokenizer.from_pretrained(pretrained)
+        model = BertModel.from_pretrained(pretrained)
+        if model_path is not None:
+            model = load_model(model, model_path, self.device)
+        self.model = model.to(self.device).eval()
+        self.label_embeddings = {}
+        self.label_lock = threading.Lock()
+        self.requests = queue.Queue()
+        self.closed = False
+        self.submit_lock = threading.Lock()
+        self.worker = threading.Thread(target=self.serve, daemon=True)
+        self.worker.start()
+
+    # 编码一批文本，返回L2归一化的[CLS]向量（由后台线程调用）
+    def encode(self, texts):
+        encodings = self.tokenizer(list(texts), add_special_tokens=True, max_length=self.max_len, padding=True,
+                                   truncation=True, return_attention_mask=True, return_tensors='pt')
+        with torch.inference_mode():
+            outputs = self.model(input_ids=encodings['input_ids'].to(self.device),
+                                 attention_mask=encodings['attention_mask'].to(self.device))
+        return F.normalize(outputs.last_hidden_state[:, 0, :], dim=-1)
+
+    # 标签的向量矩阵（行顺序与labels一致），只编码缓存中没有的标签
+    def labels_matrix(self, labels):
+        with self.label_lock:
+            missing = list(dict.fromkeys(label for label in labels if label not in self.label_embeddings))
+            for label, embedding in zip(missing, self.embed(missing)):
+                self.label_embeddings[label] = embedding
+            return torch.stack([self.label_embeddings[label] for label in labels])
+
+    # 后台线程：从队列中取出请求动态组批，推理后把向量写回各请求的Future。
+    # 无论因close()还是异常退出，之后都不再接受请求，队列中剩余请求的Future以RuntimeError结束
+    def serve(self):
+        try:
+            self.serve_batches()
+        finally:
+            with self.submit_lock:
+                self.closed = True
+            while True:
+                try:
+                    item = self.requests.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not None:
+                    item[1].set_exception(RuntimeError('TopicClassifierService已关闭'))
+
+    # 动态组批推理，直到取到停止哨兵None
+    def serve_batches(self):
+        while True:
+            item = self.requests.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                try:
+                    item = self.requests.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    self.requests.put(None)
+                    break
+                batch.append(item)
+            try:
+                embeddings = self.encode([text for text, _ in batch])
+            except BaseException as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                if not isinstance(e, Exception):
+                    raise
+                continue
+            for (_, future), embedding in zip(batch, embeddings):
+                future.set_result(embedding)
+
+    # 提交一条文本，返回其向量的Future；多个线程同时提交的文本会被合并到同一批推理。服务关闭后提交抛出RuntimeError
+    def submit(self, text):
+        future = Future()
+        with self.submit_lock:
+            if self.closed:
+                raise RuntimeError('TopicClassifierService已关闭')
+            self.requests.put((text, future))
+        return future
+
+    # 提交多条文本并等待结果，返回向量矩阵（行顺序与texts一致）
+    def embed(self, texts):
+        futures = [self.submit(text) for text in texts]
+        if not futures:
+            return torch.empty(0, self.model.config.hidden_size)
+        return torch.stack([future.result() for future in futures])
+
+    # 文本与各标签的余弦相似度矩阵（文本数 × 标签数）
+    def similarities(self, texts, labels):
+        return self.embed(texts) @ self.labels_matrix(labels).T
+
+    # 预测每条文本最相似的标签下标
+    def classify(self, texts, labels):
+        return torch.argmax(self.similarities(texts, labels), dim=1).tolist()
+
+    # 停止后台线程：已提交的请求处理完后退出，之后的提交抛出RuntimeError
+    def close(self):
+        with self.submit_lock:
+            if not self.closed:
+                self.closed = True
+                self.requests.put(None)
+        self.worker.join()
+
+
+_classifier_service = None
+_classifier_service_lock = threading.Lock()
+
+
+# 首次使用时才加载常驻的推理服务，之后的预测复用同一个模型和标签向量缓存
+def get_classifier_service():
+    global _classifier_service
+    with _classifier_service_lock:
+        if _classifier_service is None:
+            _classifier_service = TopicClassifierService()
+        return _classifier_service
+
+
+# 预测函数：使用常驻的推理服务批量预测
 def prediction(X_new, Y):
-    model_path = 'bert_model.pth'
-    device = torch.device("cpu")
-    tokenizer = BertTokenizer.from_pretrained('bert-base-chinese')
-    max_len = 48
-
-    # 初始化模型
-    model = BertModel.from_pretrained('bert-base-chinese')
-    model = load_model(model, model_path, device)
-
-    new_dataset = CustomDataset(X_new, [''] * len(X_new), tokenizer, max_len)
-    new_data_loader = DataLoader(new_dataset, batch_size=1, shuffle=False)
-
-    predictions = predict(model, new_data_loader, device, tokenizer, Y)
+    predictions = get_classifier_service().classify(X_new, Y)
     Y_new = [Y[pred] for pred in predictions]
-
-    for x in X_new:
-        print("输入：", x)
-    for y in Y_new:
-        print("预测输出：", y)
+    print(f"预测{len(X_new)}条输入，标签{len(set(Y))}个")
     return Y_new
 
 # 主函数
@@ -1,5 +1,10 @@
+import json
 import os
-from sqlalchemy import create_engine, Column, String, Integer, DateTime, Text, JSON, Float
+import re
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, inspect, text, bindparam, Column, String, Integer, DateTime, Text, JSON, Float, \
+    LargeBinary, Index, Boolean, MetaData
+from sqlalchemy.schema import CreateTable
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
@@ -9,27 +14,56 @@ DATABASE_COPY_PATH = os.path.join(os.path.dirname(__file__), "weibo_copy.db")  #
 os.makedirs(os.path.dirname(DATABASE_PATH), exist_ok=True)
 Base = declarative_base()
 
+# 博文保留时长：超过该时长的博文不再入库，并在清理时删除
+RETENTION = timedelta(hours=72)
+# 博文按发布时间分区存储，每PARTITION_HOURS小时一张分区表（blogposts_YYYYMMDDHH，24需能被整除），
+# blogposts是所有分区表的UNION ALL视图；过期清理时直接删除整张分区表，不必逐行删除
+PARTITION_HOURS = 6
+PARTITION_PREFIX = 'blogposts_'
 
-class BlogPost(Base):  # 博文对象定义
+
+class BlogPost(Base):  # 博文对象定义，映射到分区视图blogposts，写入由视图上的触发器转发到对应分区表，更新使用update_posts
 
     __tablename__ = 'blogposts'
+    __mapper_args__ = {'confirm_deleted_rows': False}  # 经由触发器的删除不计入影响行数
     id = Column(Integer, primary_key=True)  # 博文id
     username = Column(String)  # 博文发送者用户名
     text = Column(Text)  # 博文内容（已除去##话题）
-    date = Column(DateTime)  # 博文发送时间
+    date = Column(DateTime)  # 博文发送时间，决定博文所在的分区
     reposts_count = Column(Integer)  # 博文转发数
     comments_count = Column(Integer)  # 博文评论数
     likes_count = Column(Integer)  # 博文点赞数
-    topics = Column(JSON)  # 该博文相关的Topic的uuid列表
     keywords = Column(JSON, default=[])  # 关键词,字符串数组，留待分词程序提取关键词
     emotion = Column(JSON, default=[])  # 情感,情感数组，留待情感程序分析出情感
 
 
+class Token(Base):  # 词表定义：分词得到的词语及其整数id
+    __tablename__ = 'tokens'
+    id = Column(Integer, primary_key=True)
+    token = Column(String, unique=True)
+
+
+class PostTokens(Base):  # 博文分词缓存定义
+    __tablename__ = 'post_tokens'
+    post_id = Column(Integer, primary_key=True)  # 博文id
+    tokens = Column(LargeBinary)  # 博文分词结果，词语id组成的uint32数组
+
+
+class DocFreq(Base):  # 文档频率定义：包含某词语的博文数，用于语料IDF
+    __tablename__ = 'doc_freqs'
+    token_id = Column(Integer, primary_key=True)  # 词表中的词语id
+    doc_freq = Column(Integer, default=0)  # 包含该词语的博文数
+
+
 class Channel(Base):  # 微博频道定义
     __tablename__ = 'channels'
     title = Column(String)
     gid = Column(String, primary_key=True)
     containerid = Column(String)
+    since_id = Column(Integer, default=0)  # 该频道已爬取到的最大博文id，用于增量爬取
+    yield_rate = Column(Float)  # 每次请求的新博文数（指数加权平均），用于分配爬取预算
+    failures = Column(Integer, default=0)  # 连续低产出或失败的轮数
+    next_crawl_at = Column(DateTime)  # 退避结束时间，在此之前不爬取该频道
 
 
 class Weight(Base):  # 权重对象定义
@@ -50,18 +84,214 @@ class Topic(Base):  # 话题对象定义
     keywords = Column(JSON, default=[])  # 话题自身关键词,用于合并相似话题
     post_keywords = Column(JSON, default=[])  # 话题相关博文关键词及其词频，用于词云图和词频柱状图
     hot_rate = Column(Float, default=0)  # 话题热度，用于dashboard首页的话题统计图
-    blogposts = Column(JSON, default=[])  # 话题相关博文的id列表
     emotion = Column(JSON, default=[])  # 情感，用于情感柱状图
     avg_likes = Column(Float, default=0)  # 平均点赞
     avg_comments = Column(Float, default=0)  # 平均评论
     avg_reposts = Column(Float, default=0)  # 平均转发
     hot_rate_per_hr = Column(JSON, default={})  # 每3小时的热度，用于时间-话题热度变化的柱状图
+    # 相关博文的累加统计量，随博文入库和过期增量维护，avg_*、emotion由其直接得到；为NULL时尚未开始维护，需要重建
+    likes_sum = Column(Integer)  # 点赞总数
+    comments_sum = Column(Integer)  # 评论总数
+    reposts_sum = Column(Integer)  # 转发总数
+    emotion_sums = Column(JSON)  # 各情感的 [强度之和, 出现次数]
+    dirty = Column(Boolean, default=True)  # 自上次更新话题统计以来相关博文是否有变化（入库、匹配、合并、过期）
+    hot_rate_per_hr_at = Column(DateTime)  # 计算hot_rate_per_hr时第0段的结束时刻，之后只需按经过的段数平移
+
+
+class TopicPost(Base):  # 话题与博文的关联定义，主键(topic_uuid, post_id)用于按话题查博文，反向索引用于按博文查话题
+    __tablename__ = 'topic_posts'
+    topic_uuid = Column(String, primary_key=True)  # 话题UUID
+    post_id = Column(Integer, primary_key=True)  # 博文id
+    __table_args__ = (Index('ix_topic_posts_post_topic', 'post_id', 'topic_uuid'),)
+
+
+# 为已存在的数据表补充模型中新增的列（create_all不会修改已有的表），博文补充到各分区表（及尚未迁移的旧博文表）
+def migrate_schema(engine):
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if table is BlogPost.__table__:
+                table_names = [name for _, name in post_partitions(conn)]
+                if sqlite_object_type(conn, table.name) == 'table':
+                    table_names.append(table.name)
+            elif inspector.has_table(table.name):
+                table_names = [table.name]
+            else:
+                continue
+            for table_name in table_names:
+                existing_columns = {column['name'] for column in inspector.get_columns(table_name)}
+                for column in table.columns:
+                    if column.name not in existing_columns:
+                        column_type = column.type.compile(engine.dialect)
+                        conn.execute(text(f'ALTER TABLE {table_name} ADD COLUMN {column.name} {column_type}'))
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+
+
+# sqlite_master中对象的类型：'table'、'view'，不存在时为None
+def sqlite_object_type(conn, name):
+    return conn.execute(text('SELECT type FROM sqlite_master WHERE name = :name'), {'name': name}).scalar()
+
+
+# 博文发布时间所在分区的起始时刻
+def partition_start(date):
+    return date.replace(hour=date.hour - date.hour % PARTITION_HOURS, minute=0, second=0, microsecond=0)
+
+
+def partition_name(start):
+    return f'{PARTITION_PREFIX}{start:%Y%m%d%H}'
+
+
+# 数据库中已有的博文分区，按时间排序的 (起始时刻, 表名) 列表
+def post_partitions(conn):
+    partitions = []
+    for name in conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'table'")).scalars():
+        match = re.fullmatch(PARTITION_PREFIX + r'(\d{10})', name)
+        if match:
+            partitions.append((datetime.strptime(match.group(1), '%Y%m%d%H'), name))
+    return sorted(partitions)
+
+
+# SQLite中DateTime按'YYYY-MM-DD HH:MM:SS.ffffff'字符串存储，分区边界可以直接按字符串比较
+def partition_condition(column, start):
+    end = start + timedelta(hours=PARTITION_HOURS)
+    return f"{column} >= '{start:%Y-%m-%d %H:%M:%S}' AND {column} < '{end:%Y-%m-%d %H:%M:%S}'"
+
+
+# 视图blogposts及其触发器的建表语句（名称 -> SQL）：插入按NEW.date转发到对应分区（没有对应分区或date为空时报错），
+# 更新和删除按id转发到各分区。没有分区时视图为空
+def posts_view_statements(partitions):
+    columns = [column.name for column in BlogPost.__table__.columns]
+    column_list = ', '.join(columns)
+    new_values = ', '.join(f'NEW.{column}' for column in columns)
+    if partitions:
+        body = ' UNION ALL '.join(f'SELECT {column_list} FROM {name}' for _, name in partitions)
+    else:
+        body = 'SELECT ' + ', '.join(f'NULL AS {column}' for column in columns) + ' WHERE 0'
+
+    in_partition = ' OR '.join(f'({partition_condition("NEW.date", start)})' for start, _ in partitions) or '0'
+    inserts = ''.join(f'INSERT INTO {name} ({column_list}) SELECT {new_values} '
+                      f'WHERE {partition_condition("NEW.date", start)}; ' for start, name in partitions)
+    assignments = ', '.join(f'{column} = NEW.{column}' for column in columns)
+    updates = ''.join(f'UPDATE {name} SET {assignments} WHERE id = OLD.id; ' for _, name in partitions)
+    deletes = ''.join(f'DELETE FROM {name} WHERE id = OLD.id; ' for _, name in partitions)
+    return {
+        'blogposts': f'CREATE VIEW blogposts AS {body}',
+        'blogposts_insert': f"CREATE TRIGGER blogposts_insert INSTEAD OF INSERT ON blogposts BEGIN "
+                            f"SELECT RAISE(ABORT, 'no partition for blogposts.date') "
+                            f"WHERE NOT COALESCE({in_partition}, 0); {inserts}END",
+        'blogposts_update': f'CREATE TRIGGER blogposts_update INSTEAD OF UPDATE ON blogposts BEGIN '
+                            f'{updates or "SELECT RAISE(IGNORE); "}END',
+        'blogposts_delete': f'CREATE TRIGGER blogposts_delete INSTEAD OF DELETE ON blogposts BEGIN '
+                            f'{deletes or "SELECT RAISE(IGNORE); "}END'
+    }
+
+
+# 按现有分区重建视图blogposts及其触发器；视图和触发器已与现有分区（及模型的列）一致时不做修改
+def refresh_posts_view(conn):
+    statements = posts_view_statements(post_partitions(conn))
+    existing = dict(conn.execute(text("SELECT name, sql FROM sqlite_master WHERE tbl_name = 'blogposts'")).all())
+    if existing == statements:
+        return
+    conn.execute(text('DROP VIEW IF EXISTS blogposts'))
+    for statement in statements.values():
+        conn.execute(text(statement))
+
+
+# 按id批量更新博文，mappings为包含id和待更新字段的字典列表，待更新字段相同的博文用一条UPDATE语句executemany。
+# 经由视图触发器的更新不计入影响行数，ORM的更新（包括bulk_update_mappings）会因此报StaleDataError，博文只用这里的UPDATE语句更新
+def update_posts(db_session, mappings):
+    statement = BlogPost.__table__.update().where(BlogPost.__table__.c.id == bindparam('post_id'))
+    groups = {}
+    for mapping in mappings:
+        values = {key: value for key, value in mapping.items() if key != 'id'}
+        groups.setdefault(tuple(sorted(values)), []).append(dict(values, post_id=mapping['id']))
+    for rows in groups.values():
+        db_session.execute(statement, rows)
+
+
+# 创建分区表，已存在时跳过
+def create_post_partition(conn, start):
+    table = BlogPost.__table__.to_metadata(MetaData(), name=partition_name(start))
+    conn.execute(CreateTable(table, if_not_exists=True))
+
+
+# 确保dates中各发布时间所在的分区都已存在，写入博文前调用；有新分区时重建视图
+def ensure_post_partitions(db_session, dates):
+    conn = db_session.connection()
+    existing = {start for start, _ in post_partitions(conn)}
+    missing = {partition_start(date) for date in dates if date is not None} - existing
+    if not missing:
+        return
+    for start in sorted(missing):
+        create_post_partition(conn, start)
+    refresh_posts_view(conn)
+
+
+# 删除结束时刻不晚于before的分区（before为None时删除所有分区）并重建视图，返回删除的分区数
+def drop_post_partitions(db_session, before=None):
+    conn = db_session.connection()
+    dropped = [name for start, name in post_partitions(conn)
+               if before is None or start + timedelta(hours=PARTITION_HOURS) <= before]
+    for name in dropped:
+        conn.execute(text(f'DROP TABLE {name}'))
+    if dropped:
+        refresh_posts_view(conn)
+    return len(dropped)
+
+
+# 旧版本的博文保存在单张表blogposts中：按发布时间迁移到各分区表后删除旧表，发布时间为空的博文以迁移时刻为发布时间
+# 放入当前分区（与插入触发器一致，分区表中不保留空的发布时间）。最后按现有分区重建视图（已一致时不修改）
+def migrate_post_partitions(engine):
+    columns = ', '.join(column.name for column in BlogPost.__table__.columns)
+    with engine.begin() as conn:
+        if sqlite_object_type(conn, 'blogposts') == 'table':
+            now = datetime.now()
+            conn.execute(text('UPDATE blogposts SET date = :now WHERE date IS NULL').bindparams(
+                bindparam('now', now, type_=DateTime())))
+            current = partition_start(now)
+            starts = {current}
+            for hour in conn.execute(text('SELECT DISTINCT substr(date, 1, 13) FROM blogposts '
+                                          'WHERE date IS NOT NULL')).scalars():
+                starts.add(partition_start(datetime.strptime(hour, '%Y-%m-%d %H')))
+            for start in sorted(starts):
+                create_post_partition(conn, start)
+                conn.execute(text(f'INSERT OR IGNORE INTO {partition_name(start)} ({columns}) '
+                                  f'SELECT {columns} FROM blogposts WHERE {partition_condition("date", start)}'))
+            conn.execute(text('DROP TABLE blogposts'))
+        refresh_posts_view(conn)
+
+
+# 旧版本的话题与博文关系保存在 Topic.blogposts 和 BlogPost.topics 两个JSON列表中，
+# 关联表刚创建时将两者合并迁移到topic_posts，并丢弃指向已删除话题或博文的关系
+def migrate_topic_posts(engine):
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        if inspector.has_table('topics') and 'blogposts' in {c['name'] for c in inspector.get_columns('topics')}:
+            conn.execute(text('INSERT OR IGNORE INTO topic_posts (topic_uuid, post_id) '
+                              'SELECT topics.uuid, CAST(json_each.value AS INTEGER) '
+                              'FROM topics, json_each(topics.blogposts) WHERE json_valid(topics.blogposts)'))
+        if inspector.has_table('blogposts') and 'topics' in {c['name'] for c in inspector.get_columns('blogposts')}:
+            conn.execute(text("INSERT OR IGNORE INTO topic_posts (topic_uuid, post_id) "
+                              "SELECT json_extract(json_each.value, '$.uuid'), blogposts.id "
+                              "FROM blogposts, json_each(blogposts.topics) WHERE json_valid(blogposts.topics)"))
+        conn.execute(text('DELETE FROM topic_posts WHERE topic_uuid IS NULL '
+                          'OR topic_uuid NOT IN (SELECT uuid FROM topics)'))
+        if inspector.has_table('blogposts'):
+            conn.execute(text('DELETE FROM topic_posts WHERE post_id NOT IN (SELECT id FROM blogposts)'))
 
 
 # 数据库使用SQLite，初始化会话
 def get_Session(path):
-    engine = create_engine(f'sqlite:///{path}')
-    Base.metadata.create_all(engine)
+    # JSON列中的中文不转义为\uXXXX，体积更小，话题关键词频数等大字典的解析也快一倍
+    engine = create_engine(f'sqlite:///{path}', json_serializer=lambda value: json.dumps(value, ensure_ascii=False))
+    backfill_topic_posts = not inspect(engine).has_table(TopicPost.__tablename__)
+    migrate_schema(engine)
+    Base.metadata.create_all(engine, tables=[table for table in Base.metadata.sorted_tables
+                                             if table is not BlogPost.__table__])
+    if backfill_topic_posts:
+        migrate_topic_posts(engine)
+    migrate_post_partitions(engine)
     Session = sessionmaker(bind=engine)
     return Session
 
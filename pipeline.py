@@ -0,0 +1,177 @@
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from crawl_scheduler import record_crawl
+from db_operations import display_topics
+from spider import create_pooled_session, fetch_data, parse_status, analyze_post, store_posts, \
+    update_channel_cursor, next_page_url, url_gid, commit_ingest, ingest_rate, request_counts
+from text_analysis import extract_keywords
+
+# 通知下游阶段结束的哨兵
+STOP = object()
+
+
+# NLP进程池中执行：解析一页博文，并完成分词和情感分析（关键词在爬取结束后用语料IDF提取）
+def analyze_page(data):
+    posts = []
+    for status in data['statuses']:
+        post = parse_status(status)
+        if post is not None:
+            posts.append(analyze_post(post))
+    return posts
+
+
+# 某一页在任一阶段失败：计为失败请求，还有剩余次数时重新排队，并结束该任务
+def fail_job(job_queue, url, remaining, error):
+    print(f"爬取失败: {url}, {error!r}")
+    try:
+        record_crawl(url_gid(url), failed=True)
+        if remaining > 1:
+            job_queue.put((url, remaining - 1))
+    finally:
+        job_queue.task_done()
+
+
+# 抓取阶段：从任务队列取出(url, 剩余次数)，抓取后放入原始数据队列，队列满时阻塞
+def fetch_stage(job_queue, raw_queue, web_session):
+    while True:
+        job = job_queue.get()
+        if job is STOP:
+            break
+        url, remaining = job
+        try:
+            data = fetch_data(url, web_session)
+            if data is None:
+                raise RuntimeError(f"Failed to fetch data from {url}")
+        except Exception as e:
+            fail_job(job_queue, url, remaining, e)
+            continue
+        raw_queue.put((url, remaining, data))
+
+
+# NLP阶段：将原始数据提交到进程池，进行中的页数不超过max_inflight，已完成的结果按顺序放入分析结果队列；
+# 解析失败的页计为失败，不送入写入阶段。无论是否出错，最后都通知写入阶段结束
+def nlp_stage(raw_queue, analyzed_queue, job_queue, pool, max_inflight):
+    pending = deque()
+    running = True
+    try:
+        while running or pending:
+            while pending and (pending[0][3].done() or len(pending) >= max_inflight or not running):
+                url, remaining, data, future = pending.popleft()
+                try:
+                    posts = future.result()
+                except Exception as e:
+                    fail_job(job_queue, url, remaining, e)
+                    continue
+                analyzed_queue.put((url, remaining, data, posts))
+            if not running:
+                continue
+            try:
+                item = raw_queue.get(timeout=0.05)
+            except queue.Empty:
+                continue
+            if item is STOP:
+                running = False
+                continue
+            url, remaining, data = item
+            try:
+                pending.append((url, remaining, data, pool.submit(analyze_page, data)))
+            except Exception as e:
+                fail_job(job_queue, url, remaining, e)
+    finally:
+        analyzed_queue.put(STOP)
+
+
+# 写入阶段：唯一的数据库写入者，每commit_every页或队列暂时为空时提交一次。
+# 某一页入库或提交失败时回滚会话，本页和尚未提交的页都计为失败，之后继续处理后续的页
+def write_stage(analyzed_queue, job_queue, db_session, commit_every, stats):
+    db_session = db_session()
+    uncommitted = []
+
+    # 回滚会话，尚未提交的页计为失败
+    def discard_pages(error):
+        db_session.rollback()
+        for url, _ in uncommitted:
+            print(f"入库失败: {url}, {error!r}")
+            record_crawl(url_gid(url), failed=True)
+        uncommitted.clear()
+
+    def commit_pages():
+        try:
+            commit_ingest(db_session)
+        except Exception as e:
+            discard_pages(e)
+            return
+        for url, new_posts in uncommitted:
+            record_crawl(url_gid(url), new_posts)
+        stats['pages'] += len(uncommitted)
+        uncommitted.clear()
+
+    while True:
+        item = analyzed_queue.get()
+        if item is STOP:
+            break
+        url, remaining, data, posts = item
+        try:
+            new_posts = store_posts(posts, db_session, commit=False)
+            update_channel_cursor(db_session, url, data)
+        except Exception as e:
+            discard_pages(e)
+            fail_job(job_queue, url, remaining, e)
+            continue
+        uncommitted.append((url, new_posts))
+        if len(uncommitted) >= commit_every or analyzed_queue.empty():
+            commit_pages()
+        # 没有新博文时该频道提前结束，否则沿max_id向后翻页
+        if new_posts and remaining > 1:
+            job_queue.put((next_page_url(url, data) or url, remaining - 1))
+        job_queue.task_done()
+    commit_pages()
+    db_session.close()
+
+
+# 流水线爬取：抓取线程 -> NLP进程池 -> 单一写入线程，各阶段之间用有界队列连接
+def multi_pipeline(db_session, urls, num_requests_per_thread=5, num_fetchers=8, commit_every=10, plan=None,
+                   num_workers=None, queue_size=32):
+    time_start = time.time()
+    num_workers = num_workers or os.cpu_count() or 1
+    job_queue = queue.Queue()
+    raw_queue = queue.Queue(maxsize=queue_size)
+    analyzed_queue = queue.Queue(maxsize=queue_size)
+    stats = {'pages': 0}
+
+    for url, num_requests in zip(urls, request_counts(urls, num_requests_per_thread, plan)):
+        job_queue.put((url, num_requests))
+
+    web_session = create_pooled_session(num_fetchers)
+    with ProcessPoolExecutor(max_workers=num_workers) as pool:
+        fetchers = [threading.Thread(target=fetch_stage, args=(job_queue, raw_queue, web_session))
+                    for _ in range(num_fetchers)]
+        nlp = threading.Thread(target=nlp_stage, args=(raw_queue, analyzed_queue, job_queue, pool, num_workers * 2))
+        writer = threading.Thread(target=write_stage,
+                                  args=(analyzed_queue, job_queue, db_session, commit_every, stats))
+        for t in fetchers + [nlp, writer]:
+            t.start()
+
+        # 所有任务（包括翻页产生的后续任务）都写入数据库后，依次关闭各阶段
+        job_queue.join()
+        for _ in fetchers:
+            job_queue.put(STOP)
+        for t in fetchers:
+            t.join()
+        raw_queue.put(STOP)
+        nlp.join()
+        writer.join()
+    web_session.close()
+
+    extract_keywords(db_session())
+    display_topics(db_session())
+
+    time_end = time.time()
+    print(f"流水线爬取成功{stats['pages']}页")
+    print('流水线爬取用时为', time_end - time_start, 's')
+    print(f'入库速度: {ingest_rate():.1f} posts/sec')
+    return stats
@@ -0,0 +1,192 @@
+import argparse
+import json
+import os
+import random
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+from urllib.parse import urlparse, parse_qs
+
+# 回放时每轮循环给博文id加上的偏移量，保证重复回放的博文不会被当作重复博文丢弃
+ID_STRIDE = 10 ** 12
+
+
+# 录制微博接口的原始响应：allGroups保存为allGroups.json，每个频道的hottimeline保存为hottimeline/<gid>_<n>.json
+def record_responses(out_dir, num_pages=3, base_url="https://weibo.com"):
+    from spider import create_session
+
+    session = create_session()
+    os.makedirs(os.path.join(out_dir, 'hottimeline'), exist_ok=True)
+
+    response = session.get(f"{base_url}/ajax/feed/allGroups?is_new_segment=1&fetch_hot=1")
+    response.raise_for_status()
+    with open(os.path.join(out_dir, 'allGroups.json'), 'wb') as f:
+        f.write(response.content)
+
+    for group in response.json()['groups']:
+        if group['title'] not in ["我的频道", "频道推荐"]:
+            continue
+        for channel in group['group']:
+            url = (f"{base_url}/ajax/feed/hottimeline?since_id=0&refresh=0&group_id={channel['gid']}"
+                   f"&containerid={channel['containerid']}&extparam=discover%7Cnew_feed&max_id=0&count=10")
+            for n in range(num_pages):
+                page = session.get(url)
+                if page.status_code != 200:
+                    print(f"录制失败: {url}, status code: {page.status_code}")
+                    continue
+                with open(os.path.join(out_dir, 'hottimeline', f"{channel['gid']}_{n}.json"), 'wb') as f:
+                    f.write(page.content)
+        print(f"已录制频道组: {group['title']}")
+
+
+# 读取录制目录，返回allGroups响应和按频道gid分组的hottimeline响应列表
+def load_fixtures(fixture_dir):
+    with open(os.path.join(fixture_dir, 'allGroups.json'), 'rb') as f:
+        channels = f.read()
+    pages = {}
+    timeline_dir = os.path.join(fixture_dir, 'hottimeline')
+    for filename in sorted(os.listdir(timeline_dir)):
+        gid = filename.rsplit('_', 1)[0]
+        with open(os.path.join(timeline_dir, filename), 'rb') as f:
+            pages.setdefault(gid, []).append(f.read())
+    return channels, pages
+
+
+# 没有录制数据时生成合成数据：num_channels个频道，每页page_size条博文
+def synthetic_fixtures(num_channels=9, num_pages=3, page_size=10):
+    post_ids = count(1)
+    created_at = datetime.now().strftime('%a %b %d %H:%M:%S +0800 %Y')
+    groups = [{'title': '我的频道', 'group': [
+        {'title': f'频道{i}', 'gid': str(i), 'containerid': str(i)} for i in range(num_channels)]}]
+    channels = json.dumps({'groups': groups}).encode('utf-8')
+
+    pages = {}
+    for i in range(num_channels):
+        for _ in range(num_pages):
+            statuses = []
+            for _ in range(page_size):
+                post_id = next(post_ids)
+                statuses.append({
+                    'id': post_id,
+                    'user': {'screen_name': f'user{post_id % 100}'},
+                    'text_raw': f'#测试话题{post_id % 20}#今天天气很好，大家都很开心{post_id}',
+                    'created_at': created_at,
+                    'reposts_count': post_id % 7,
+                    'comments_count': post_id % 11,
+                    'attitudes_count': post_id % 13,
+                    'topic_struct': [{'topic_title': f'测试话题{post_id % 20}',
+                                      'actionlog': {'uuid': f'stub-topic-{post_id % 20}'}}]
+                })
+            pages.setdefault(str(i), []).append(json.dumps({'statuses': statuses}).encode('utf-8'))
+    return channels, pages
+
+
+# 回放服务器的请求处理：按频道循环回放录制的响应，可配置延迟和错误注入
+class ReplayHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        server = self.server
+        time.sleep(server.latency)
+        with server.lock:
+            server.hits += 1
+            fail = server.random.random() < server.error_rate
+
+        if fail:
+            self.send_body(500, b'{"ok": 0}')
+            return
+
+        url = urlparse(self.path)
+        if url.path.endswith('/allGroups'):
+            self.send_body(200, server.channels)
+        elif url.path.endswith('/hottimeline'):
+            gid = parse_qs(url.query).get('group_id', [''])[0]
+            self.send_body(200, server.next_page(gid))
+        else:
+            self.send_body(404, b'{"ok": 0}')
+
+    def send_body(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ReplayServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, channels, pages, latency=0.0, error_rate=0.0, fresh=True, seed=0, port=0):
+        super().__init__(('127.0.0.1', port), ReplayHandler)
+        self.channels = channels
+        self.pages = pages
+        self.latency = latency
+        self.error_rate = error_rate
+        self.fresh = fresh
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.cursors = {}
+
+    @property
+    def base_url(self):
+        host, port = self.server_address
+        return f"http://{host}:{port}"
+
+    # 取出某频道的下一页响应；fresh为True时每轮循环改写博文id并把发布时间设为当前时间
+    def next_page(self, gid):
+        pages = self.pages.get(gid) or next(iter(self.pages.values()))
+        with self.lock:
+            n = self.cursors.get(gid, 0)
+            self.cursors[gid] = n + 1
+        body = pages[n % len(pages)]
+        if not self.fresh:
+            return body
+
+        data = json.loads(body)
+        created_at = datetime.now().strftime('%a %b %d %H:%M:%S +0800 %Y')
+        for status in data.get('statuses', []):
+            status['id'] = int(status['id']) + n // len(pages) * ID_STRIDE
+            status['created_at'] = created_at
+        return json.dumps(data).encode('utf-8')
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+# 启动回放服务器，fixture_dir为空时使用合成数据
+def start_replay_server(fixture_dir=None, latency=0.0, error_rate=0.0, fresh=True, seed=0, port=0):
+    channels, pages = load_fixtures(fixture_dir) if fixture_dir else synthetic_fixtures()
+    return ReplayServer(channels, pages, latency, error_rate, fresh, seed, port).start()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    record_parser = subparsers.add_parser('record', help='录制微博接口的原始响应')
+    record_parser.add_argument('--out', default='fixtures')
+    record_parser.add_argument('--pages', type=int, default=3)
+
+    serve_parser = subparsers.add_parser('serve', help='启动本地回放服务器')
+    serve_parser.add_argument('--dir', default=None)
+    serve_parser.add_argument('--port', type=int, default=8000)
+    serve_parser.add_argument('--latency', type=float, default=0.0)
+    serve_parser.add_argument('--error-rate', type=float, default=0.0)
+
+    args = parser.parse_args()
+    if args.command == 'record':
+        record_responses(args.out, args.pages)
+    else:
+        server = start_replay_server(args.dir, args.latency, args.error_rate, port=args.port)
+        print(f"回放服务器已启动: {server.base_url}")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            server.shutdown()
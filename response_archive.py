@@ -0,0 +1,136 @@
+import argparse
+import gzip
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+
+# 原始响应归档：每条响应压缩为一个独立的gzip成员追加到分段文件中，分段文件超过segment_size后滚动到新文件；
+# index.db记录每条响应所在的分段和偏移，以及博文id到响应位置的索引
+class ResponseArchive:
+
+    def __init__(self, directory, segment_size=64 * 1024 * 1024):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+        self.index = sqlite3.connect(os.path.join(directory, 'index.db'), check_same_thread=False)
+        self.index.execute('PRAGMA journal_mode=WAL')
+        self.index.execute('PRAGMA synchronous=NORMAL')
+        self.index.execute('CREATE TABLE IF NOT EXISTS responses ('
+                           'id INTEGER PRIMARY KEY, segment INTEGER, offset INTEGER, length INTEGER, '
+                           'url TEXT, fetched_at TEXT)')
+        self.index.execute('CREATE TABLE IF NOT EXISTS posts (post_id INTEGER PRIMARY KEY, response_id INTEGER)')
+        self.index.commit()
+
+        last_segment = self.index.execute('SELECT MAX(segment) FROM responses').fetchone()[0]
+        self.segment = last_segment or 1
+        self.segment_file = open(self.segment_path(self.segment), 'ab')
+
+    def segment_path(self, segment):
+        return os.path.join(self.directory, f'segment_{segment:06d}.gz')
+
+    # 追加一条原始响应，并为其中的博文建立索引
+    def append(self, url, raw, data=None):
+        record = gzip.compress(raw)
+        post_ids = [status['id'] for status in (data or {}).get('statuses', [])]
+        with self.lock:
+            if self.segment_file.tell() + len(record) > self.segment_size and self.segment_file.tell():
+                self.segment_file.close()
+                self.segment += 1
+                self.segment_file = open(self.segment_path(self.segment), 'ab')
+            offset = self.segment_file.tell()
+            self.segment_file.write(record)
+            self.segment_file.flush()
+
+            cursor = self.index.execute(
+                'INSERT INTO responses (segment, offset, length, url, fetched_at) VALUES (?, ?, ?, ?, ?)',
+                (self.segment, offset, len(record), url, datetime.now().isoformat()))
+            self.index.executemany('INSERT OR REPLACE INTO posts (post_id, response_id) VALUES (?, ?)',
+                                   [(post_id, cursor.lastrowid) for post_id in post_ids])
+            self.index.commit()
+
+    def read(self, segment, offset, length):
+        with open(self.segment_path(segment), 'rb') as f:
+            f.seek(offset)
+            return json.loads(gzip.decompress(f.read(length)))
+
+    # 根据博文id取出包含该博文的最近一次原始响应
+    def lookup(self, post_id):
+        row = self.index.execute('SELECT r.segment, r.offset, r.length FROM posts p '
+                                 'JOIN responses r ON r.id = p.response_id WHERE p.post_id = ?',
+                                 (post_id,)).fetchone()
+        return self.read(*row) if row else None
+
+    # 按写入顺序流式读取归档中的所有原始响应
+    def iter_responses(self):
+        self.segment_file.flush()
+        rows = self.index.execute('SELECT segment, offset, length FROM responses ORDER BY segment, offset')
+        f, current = None, None
+        for segment, offset, length in rows:
+            if segment != current:
+                if f:
+                    f.close()
+                f, current = open(self.segment_path(segment), 'rb'), segment
+            f.seek(offset)
+            yield json.loads(gzip.decompress(f.read(length)))
+        if f:
+            f.close()
+
+    def close(self):
+        with self.lock:
+            self.segment_file.close()
+            self.index.close()
+
+
+# 将归档中的原始响应重新送入parse_and_store_data：不受72小时限制，已存在的博文按新的处理逻辑覆盖，
+# 最后与爬取流程一样用语料IDF提取关键词
+def reprocess(directory, db_session, commit_every=50):
+    from spider import parse_and_store_data
+    from text_analysis import extract_keywords
+
+    archive = ResponseArchive(directory)
+    db_session = db_session()
+    time_start = time.time()
+    responses = 0
+    for data in archive.iter_responses():
+        if 'statuses' not in data:
+            continue
+        parse_and_store_data(data, db_session, commit=False, max_age=None, overwrite=True)
+        responses += 1
+        if responses % commit_every == 0:
+            db_session.commit()
+    db_session.commit()
+    extract_keywords(db_session)
+    db_session.close()
+    archive.close()
+
+    elapsed = time.time() - time_start
+    print(f"重新处理{responses}条响应，用时{elapsed:.2f}s")
+    return responses
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    reprocess_parser = subparsers.add_parser('reprocess', help='从归档重新处理原始响应，无需重新爬取')
+    reprocess_parser.add_argument('--dir', default='archive')
+    reprocess_parser.add_argument('--commit-every', type=int, default=50)
+
+    lookup_parser = subparsers.add_parser('lookup', help='查询包含某博文的原始响应')
+    lookup_parser.add_argument('post_id', type=int)
+    lookup_parser.add_argument('--dir', default='archive')
+
+    args = parser.parse_args()
+    if args.command == 'reprocess':
+        from models import Session
+        reprocess(args.dir, Session, args.commit_every)
+    else:
+        archive = ResponseArchive(args.dir)
+        print(json.dumps(archive.lookup(args.post_id), ensure_ascii=False, indent=2))
+        archive.close()
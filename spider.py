@@ -1,15 +1,31 @@
+import asyncio
 import re
 import threading
 import time
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import urlparse, parse_qs, urlencode
 import jieba
 import requests
-from sqlalchemy import exists
+from requests.adapters import HTTPAdapter
+from sqlalchemy import func
 from db_operations import display_topics
 from topic_emotion import analyze_sentiment
-from models import Session, Channel, Topic, BlogPost
+from models import RETENTION, Session, Channel, Topic, BlogPost, TopicPost, ensure_post_partitions, update_posts
 from data_preprocessing import merge_topics
+from crawl_scheduler import allocate_requests, apply_crawl_results, record_crawl
+from response_archive import ResponseArchive
 from text_analysis import extract_topic_keywords, extract_post_keywords, extract_keywords
+from token_cache import cache_post_tokens
+from topic_aggregates import POST_VALUE_FIELDS, post_values, update_posts_topic_stats, update_topic_stats
+
+
+# 微博接口地址，基准测试时可替换为本地回放服务器地址
+WEIBO_URL = "https://weibo.com"
+# 超过该时长的博文不入库，与博文保留时长一致
+MAX_POST_AGE = RETENTION
+# 原始响应归档（ResponseArchive），为None时不归档，由multi_spider(archive_dir=...)开启
+response_archive = None
 
 
 # 将博文文本中的##话题清除
@@ -17,9 +33,9 @@ def clean_text(raw_text):
     return re.sub(r"#.*?#", "", raw_text).strip()
 
 
-def fetch_channel_data():
+def fetch_channel_data(base_url=WEIBO_URL):
     session = create_session()
-    url = "https://weibo.com/ajax/feed/allGroups?is_new_segment=1&fetch_hot=1"
+    url = f"{base_url}/ajax/feed/allGroups?is_new_segment=1&fetch_hot=1"
     response = session.get(url)
     if response.status_code == 200:
         return response.json()
@@ -27,9 +43,9 @@ def fetch_channel_data():
         raise RuntimeError("Failed to fetch channel data")
 
 
-def save_channels_to_db():
-    db_session = Session()
-    groups = fetch_channel_data()['groups']
+def save_channels_to_db(db_session=Session, base_url=WEIBO_URL):
+    db_session = db_session()
+    groups = fetch_channel_data(base_url)['groups']
     for group in groups:
         if group['title'] in ["我的频道", "频道推荐"]:
             for channel in group['group']:
@@ -49,7 +65,10 @@ def fetch_data(url, session):
 
     if response.status_code == 200:
         try:
-            return response.json()
+            data = response.json()
+            if response_archive is not None:
+                response_archive.append(url, response.content, data)
+            return data
         except ValueError:
             print("Error: Unable to parse JSON response")
             print(response.content)
@@ -58,66 +77,261 @@ def fetch_data(url, session):
         print(response.content)
 
 
-# 从JSON数据中提取需要的部分，并保存到数据库
-def parse_and_store_data(data, db_session):
-    for status in data['statuses']:
-        post_id = status['id']
-        username = status['user']['screen_name']
-        text = clean_text(status['text_raw'])
-        date = datetime.strptime(status['created_at'], '%a %b %d %H:%M:%S +0800 %Y')
-        reposts_count = status['reposts_count']
-        comments_count = status['comments_count']
-        likes_count = status['attitudes_count']
-        topics = []
-
-        # 检测 BlogPost 的时间，如果超过 72 小时，则不插入数据库
-        if datetime.now() - date > timedelta(hours=72):
-            continue
+# 入库速度统计：累计入库页数、博文数与入库耗时，多个爬取线程共享
+ingest_stats = {'pages': 0, 'posts': 0, 'seconds': 0.0}
+ingest_lock = threading.Lock()
 
-        # 重复博文校验
-        if not db_session.query(exists().where(BlogPost.id == post_id)).scalar():
-            for topic in status.get('topic_struct', []):
-                topic_title = topic['topic_title']
-                topic_uuid = topic['actionlog']['uuid']
-                topics.append({'uuid': topic_uuid})
-                existing_topic = db_session.query(Topic).filter_by(uuid=topic_uuid).first()
-                if not existing_topic:
-                    # 如果该话题不存在，创建新的话题对象，并将post_count初始化为1
-                    existing_topic = Topic(uuid=topic_uuid, topic_title=topic_title, blogposts=[post_id], post_count=1)
-                    db_session.add(existing_topic)
-                else:
-                    # 如果该话题已存在，更新话题的博文数，并将博文ID添加到话题的博文列表中
-                    existing_topic.post_count += 1
-                    if post_id not in existing_topic.blogposts:
-                        existing_topic.blogposts.append(post_id)
-
-            sentiment_data = analyze_sentiment(list(jieba.cut(text)))
-            new_post = BlogPost(
-                id=post_id,
-                username=username,
-                text=text,
-                date=date,
-                reposts_count=reposts_count,
-                comments_count=comments_count,
-                likes_count=likes_count,
-                topics=topics,
-                emotion=sentiment_data
-            )
-            db_session.add(new_post)
-            db_session.commit()
-    db_session.close()
-
-
-# 爬取函数
-def spider(db_session, web_session, url, thread_id, num_requests):
-    db_session = db_session()
+
+def record_ingest(posts, seconds, pages=0):
+    with ingest_lock:
+        ingest_stats['pages'] += pages
+        ingest_stats['posts'] += posts
+        ingest_stats['seconds'] += seconds
+
+
+def reset_ingest_stats():
+    with ingest_lock:
+        ingest_stats.update(pages=0, posts=0, seconds=0.0)
+
+
+# 获取入库速度（博文数/秒）
+def ingest_rate():
+    with ingest_lock:
+        if not ingest_stats['seconds']:
+            return 0.0
+        return ingest_stats['posts'] / ingest_stats['seconds']
+
+
+# 从单条博文状态中提取需要的部分，超过 max_age（默认为博文保留时长）的博文返回 None，max_age为None时不限制
+def parse_status(status, max_age=MAX_POST_AGE):
+    date = datetime.strptime(status['created_at'], '%a %b %d %H:%M:%S +0800 %Y')
+    if max_age is not None and datetime.now() - date > max_age:
+        return None
+    return {
+        'id': status['id'],
+        'username': status['user']['screen_name'],
+        'text': clean_text(status['text_raw']),
+        'date': date,
+        'reposts_count': status['reposts_count'],
+        'comments_count': status['comments_count'],
+        'likes_count': status['attitudes_count'],
+        'topics': [(topic['actionlog']['uuid'], topic['topic_title']) for topic in status.get('topic_struct', [])]
+    }
+
+
+# 从JSON数据中提取需要的部分，并按页批量保存到数据库，返回新入库的博文数
+# commit为False时不提交也不关闭会话，由调用方每N页提交一次
+def parse_and_store_data(data, db_session, commit=True, max_age=MAX_POST_AGE, overwrite=False):
+    posts = [parse_status(status, max_age) for status in data['statuses']]
+    return store_posts([post for post in posts if post is not None], db_session, commit, overwrite)
+
+
+# 对博文只分词一次，情感由分词结果得到；已有的字段（如由NLP进程池预先算好）不再重新计算。
+# 关键词入库时留空，爬取结束后由 extract_keywords 使用语料IDF统一提取（分词结果已缓存，不会再次分词）
+def analyze_post(post):
+    if post.get('tokens') is None:
+        post['tokens'] = jieba.lcut(post['text'])
+    if post.get('emotion') is None:
+        post['emotion'] = analyze_sentiment(post['tokens'])
+    if post.get('keywords') is None:
+        post['keywords'] = []
+    return post
+
+
+# 按最新的处理逻辑重写已存在的博文：更新正文、互动数、情感、关键词和分词缓存，以及所属话题的累加统计量
+def overwrite_posts(posts, db_session):
+    old_values, new_values = {}, {}
+    for blogpost in db_session.query(BlogPost.id, *[getattr(BlogPost, field) for field in POST_VALUE_FIELDS]) \
+            .filter(BlogPost.id.in_(list(posts))):
+        old_values[blogpost.id] = post_values(blogpost)
+        new_values[blogpost.id] = analyze_post(posts[blogpost.id])
+    update_posts(db_session, [{'id': post_id, 'username': post['username'], 'text': post['text'],
+                               'reposts_count': post['reposts_count'], 'comments_count': post['comments_count'],
+                               'likes_count': post['likes_count'], 'emotion': post['emotion'],
+                               'keywords': post['keywords']} for post_id, post in new_values.items()])
+    update_posts_topic_stats(db_session, removed=old_values, added=new_values)
+    cache_post_tokens(db_session, {post_id: post['tokens'] for post_id, post in posts.items()}, replace=True)
+
+
+# 批量保存已解析的博文；博文已带有tokens/emotion（由NLP进程池预先算好）时直接使用
+# overwrite为True时已存在的博文也按新的处理逻辑重写（用于从归档重新处理）
+def store_posts(posts, db_session, commit=True, overwrite=False):
+    time_start = time.time()
+    unique_posts = {}
+    for post in posts:
+        unique_posts.setdefault(post['id'], post)
+    posts = unique_posts
+
+    new_posts = []
+    if posts:
+        # 重复博文校验：整页博文id一次IN查询
+        existing_ids = {row[0] for row in db_session.query(BlogPost.id).filter(BlogPost.id.in_(list(posts)))}
+        new_posts = [post for post_id, post in posts.items() if post_id not in existing_ids]
+        if overwrite and existing_ids:
+            overwrite_posts({post_id: posts[post_id] for post_id in existing_ids}, db_session)
+
+    # 一次性查询本页涉及的所有话题
+    topic_uuids = {topic_uuid for post in new_posts for topic_uuid, _ in post['topics']}
+    existing_topics = {}
+    if topic_uuids:
+        existing_topics = {topic.uuid: topic
+                           for topic in db_session.query(Topic).filter(Topic.uuid.in_(list(topic_uuids)))}
+
+    ensure_post_partitions(db_session, [post['date'] for post in new_posts])
+    topic_posts = {}
+    for post in new_posts:
+        post_id = post['id']
+        analyze_post(post)
+        # 同一条博文中重复出现的话题只关联一次
+        for topic_uuid, topic_title in dict(post['topics']).items():
+            if topic_uuid not in existing_topics:
+                # 如果该话题不存在，创建新的话题对象，累加统计量从0开始维护
+                existing_topic = Topic(uuid=topic_uuid, topic_title=topic_title, post_count=0, likes_sum=0,
+                                       comments_sum=0, reposts_sum=0, emotion_sums={}, post_keywords={})
+                db_session.add(existing_topic)
+                existing_topics[topic_uuid] = existing_topic
+            topic_posts.setdefault(topic_uuid, []).append(post)
+            db_session.add(TopicPost(topic_uuid=topic_uuid, post_id=post_id))
+        new_post = BlogPost(
+            id=post_id,
+            username=post['username'],
+            text=post['text'],
+            date=post['date'],
+            reposts_count=post['reposts_count'],
+            comments_count=post['comments_count'],
+            likes_count=post['likes_count'],
+            keywords=post['keywords'],
+            emotion=post['emotion']
+        )
+        db_session.add(new_post)
+    # 将本页新博文计入所属话题的博文数和累加统计量
+    for topic_uuid, topic_posts_added in topic_posts.items():
+        update_topic_stats(existing_topics[topic_uuid], added=topic_posts_added)
+    cache_post_tokens(db_session, {post['id']: post['tokens'] for post in new_posts})
+
+    if commit:
+        db_session.commit()
+        db_session.close()
+    record_ingest(len(new_posts), time.time() - time_start, pages=1)
+    return len(new_posts)
+
+
+# 构造频道的hottimeline请求URL，since_id为该频道的增量爬取游标，max_id用于向后翻页
+def build_channel_url(gid, containerid, refresh=0, since_id=0, max_id=0, base_url=WEIBO_URL):
+    params = {
+        'since_id': since_id or 0,
+        'refresh': refresh,
+        'group_id': gid,
+        'containerid': containerid,
+        'extparam': 'discover|new_feed',
+        'max_id': max_id,
+        'count': 10
+    }
+    return f"{base_url}/ajax/feed/hottimeline?{urlencode(params)}"
+
+
+# 根据响应中的max_id构造下一页的URL，响应中没有max_id时返回None
+def next_page_url(url, data):
+    max_id = data.get('max_id')
+    if not max_id:
+        return None
+    parsed = urlparse(url)
+    params = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+    params['max_id'] = max_id
+    return parsed._replace(query=urlencode(params)).geturl()
+
+
+# 从hottimeline请求URL中获取频道gid
+def url_gid(url):
+    return parse_qs(urlparse(url).query).get('group_id', [None])[0]
+
+
+# 将频道游标推进到本页出现的最大博文id
+def update_channel_cursor(db_session, url, data):
+    gid = url_gid(url)
+    if gid is None or not data.get('statuses'):
+        return
+    max_id = max(int(status['id']) for status in data['statuses'])
+    db_session.query(Channel).filter_by(gid=gid).update(
+        {Channel.since_id: func.max(func.coalesce(Channel.since_id, 0), max_id)}, synchronize_session=False)
+
+
+# 入库一页数据并更新频道游标，返回新入库的博文数
+def store_page(data, db_session, url, commit=True):
+    new_posts = parse_and_store_data(data, db_session, commit=False)
+    update_channel_cursor(db_session, url, data)
+    if commit:
+        db_session.commit()
+        db_session.close()
+    return new_posts
+
+
+# 提交数据库，并将提交耗时计入入库速度统计
+def commit_ingest(db_session):
+    time_start = time.time()
+    db_session.commit()
+    record_ingest(0, time.time() - time_start)
+
+
+# 回滚写入会话，尚未提交的页计为失败
+def discard_pages(db_session, uncommitted, error):
+    db_session.rollback()
+    for url, _ in uncommitted:
+        print(f"入库失败: {url}, {error!r}")
+        record_crawl(url_gid(url), failed=True)
+    uncommitted.clear()
+
+
+# 提交写入会话，提交成功后才记录这些页的爬取统计；提交失败时返回False
+def commit_pages(db_session, uncommitted):
+    try:
+        commit_ingest(db_session)
+    except Exception as e:
+        discard_pages(db_session, uncommitted, e)
+        return False
+    for url, new_posts in uncommitted:
+        record_crawl(url_gid(url), new_posts)
+    uncommitted.clear()
+    return True
+
+
+# 在多线程爬取的写入线程中入库一页，累计commit_every页后提交；入库或提交出错时回滚，
+# 尚未提交的页（包括本页）都计为失败并返回None
+def write_page(data, db_session, url, uncommitted, commit_every):
+    try:
+        new_posts = store_page(data, db_session, url, commit=False)
+    except Exception as e:
+        uncommitted.append((url, 0))
+        discard_pages(db_session, uncommitted, e)
+        return None
+    uncommitted.append((url, new_posts))
+    if len(uncommitted) >= commit_every and not commit_pages(db_session, uncommitted):
+        return None
+    return new_posts
+
+
+# 爬取函数：抓取在本线程中进行，入库交给所有爬取线程共享的单一写入线程（store_pool）和写入会话，
+# 与异步和流水线模式一样，话题的累加统计量只在一个会话中读改写，不会被并发的页互相覆盖。
+# 某一页没有新博文时提前结束，否则沿max_id向后翻页
+def spider(store_pool, store_session, uncommitted, web_session, url, thread_id, num_requests, commit_every=1):
     for i in range(num_requests):
+        new_posts = None
         try:
             data = fetch_data(url, web_session)
-            parse_and_store_data(data, db_session)
-            print(f"线程{thread_id} - 第{i + 1}次爬取成功")
+            if data is None:
+                raise RuntimeError(f"Failed to fetch data from {url}")
+            new_posts = store_pool.submit(write_page, data, store_session, url, uncommitted, commit_every).result()
         except RuntimeError:
+            record_crawl(url_gid(url), failed=True)
+        if new_posts is None:
             print(f"线程{thread_id} - 第{i + 1}次爬取失败")
+            continue
+        print(f"线程{thread_id} - 第{i + 1}次爬取成功，新博文{new_posts}条")
+
+        if new_posts == 0:
+            print(f"线程{thread_id} - 没有新博文，停止爬取")
+            break
+        url = next_page_url(url, data) or url
 
 
 # 创建web会话
@@ -140,42 +354,166 @@ def create_session():
     return session
 
 
-def multi_thread(db_session, urls, num_requests_per_thread=5):
+# 创建带连接池的web会话，异步爬取时所有请求共享同一个会话
+def create_pooled_session(pool_size=10):
+    session = create_session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+# 每个URL的请求次数（与urls一一对应），多线程、异步和流水线爬取共用：
+# plan为URL到请求次数的映射，给定时按plan分配；否则首批3个URL请求50次，其余URL请求num_requests_per_thread次
+def request_counts(urls, num_requests_per_thread, plan=None):
+    if plan is not None:
+        return [plan[url] for url in urls]
+    return [50 if i < 3 else num_requests_per_thread for i in range(len(urls))]
+
+
+# plan为URL到请求次数的映射，给定时按plan分配每个URL的请求次数
+def multi_thread(db_session, urls, num_requests_per_thread=5, commit_every=1, plan=None):
     time_start = time.time()
+    store_pool = ThreadPoolExecutor(max_workers=1)
+    store_session = store_pool.submit(db_session).result()
+    uncommitted = []
+    counts = request_counts(urls, num_requests_per_thread, plan)
     for i in range(0, len(urls), 3):
         threads = []
         for j in range(3):
             if i + j < len(urls):
                 web_session = create_session()
-                if i == 0:
-                    t = threading.Thread(target=spider,
-                                         args=(db_session, web_session, urls[i + j], j, 50))
-                else:
-                    t = threading.Thread(target=spider,
-                                         args=(db_session, web_session, urls[i + j], j, num_requests_per_thread))
+                t = threading.Thread(target=spider,
+                                     args=(store_pool, store_session, uncommitted, web_session, urls[i + j], j,
+                                           counts[i + j], commit_every))
                 threads.append(t)
                 t.start()
         for t in threads:
             t.join()
+        store_pool.submit(commit_pages, store_session, uncommitted).result()
 
         extract_keywords(db_session())
         display_topics(db_session())
+    store_pool.submit(store_session.close).result()
+    store_pool.shutdown()
 
     time_end = time.time()
     print('多线程爬取用时为', time_end - time_start, 's')
+    print(f'入库速度: {ingest_rate():.1f} posts/sec')
+
+
+# 在数据库写入线程中保存一页博文；失败时回滚共享的写入会话，使后续的页可以继续写入
+def store_page_or_rollback(data, db_session, url):
+    try:
+        return store_page(data, db_session, url)
+    except Exception:
+        db_session.rollback()
+        raise
+
+
+# 异步爬取协程：从队列中持续取出URL，爬取完成后若还有剩余次数则重新放回队尾；
+# 任何一页的抓取、解析或入库出错都只计为该页失败，协程继续处理队列中的其他URL
+async def async_spider(queue, web_session, db_session, fetch_pool, store_pool, host_limits, stats):
+    loop = asyncio.get_running_loop()
+    while True:
+        url, remaining = await queue.get()
+        try:
+            async with host_limits[urlparse(url).netloc]:
+                data = await loop.run_in_executor(fetch_pool, fetch_data, url, web_session)
+            if data is None:
+                raise RuntimeError(f"Failed to fetch data from {url}")
+            # 数据库写入统一交给单线程执行，避免SQLite写锁竞争
+            new_posts = await loop.run_in_executor(store_pool, store_page_or_rollback, data, db_session, url)
+            record_crawl(url_gid(url), new_posts)
+            stats['pages'] += 1
+            # 没有新博文时该频道提前结束，否则沿max_id向后翻页
+            if new_posts and remaining > 1:
+                queue.put_nowait((next_page_url(url, data) or url, remaining - 1))
+        except Exception as e:
+            record_crawl(url_gid(url), failed=True)
+            stats['failed'] += 1
+            print(f"爬取失败: {url}, {e!r}")
+            if remaining > 1:
+                queue.put_nowait((url, remaining - 1))
+        finally:
+            queue.task_done()
+
+
+async def run_async_spider(db_session, urls, num_requests_per_thread, max_concurrency, per_host_concurrency,
+                           plan=None):
+    queue = asyncio.Queue()
+    for url, num_requests in zip(urls, request_counts(urls, num_requests_per_thread, plan)):
+        queue.put_nowait((url, num_requests))
+
+    hosts = {urlparse(url).netloc for url in urls}
+    host_limits = {host: asyncio.Semaphore(per_host_concurrency) for host in hosts}
+    stats = {'pages': 0, 'failed': 0}
+    web_session = create_pooled_session(max_concurrency)
+    with ThreadPoolExecutor(max_workers=max_concurrency) as fetch_pool, \
+            ThreadPoolExecutor(max_workers=1) as store_pool:
+        store_session = store_pool.submit(db_session).result()
+        workers = [asyncio.create_task(async_spider(queue, web_session, store_session, fetch_pool, store_pool,
+                                                    host_limits, stats))
+                   for _ in range(max_concurrency)]
+        await queue.join()
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+    web_session.close()
+    return stats
 
 
-def multi_spider(db_session, num_requests_per_thread=8):
-    url1 = "https://weibo.com/ajax/feed/hottimeline?since_id=0&refresh="
-    url2 = "&group_id="
-    url3 = "&containerid="
-    url4 = "&extparam=discover%7Cnew_feed&max_id=0&count=10"
+# 异步爬取：全局并发数为max_concurrency，同一主机的并发数不超过per_host_concurrency
+def multi_async(db_session, urls, num_requests_per_thread=5, max_concurrency=8, per_host_concurrency=4, plan=None):
+    time_start = time.time()
+    stats = asyncio.run(run_async_spider(db_session, urls, num_requests_per_thread, max_concurrency,
+                                         per_host_concurrency, plan))
+
+    extract_keywords(db_session())
+    display_topics(db_session())
+
+    time_end = time.time()
+    print(f"异步爬取成功{stats['pages']}页，失败{stats['failed']}页")
+    print('异步爬取用时为', time_end - time_start, 's')
+    print(f'入库速度: {ingest_rate():.1f} posts/sec')
+    return stats
+
 
-    save_channels_to_db()
+# adaptive为True时使用自适应调度：每个频道只生成一个URL，请求预算按频道的新博文产出率分配，低产出频道指数退避
+# archive_dir不为空时将所有原始响应归档到该目录，供response_archive重新处理
+def multi_spider(db_session, num_requests_per_thread=8, mode='thread', max_concurrency=8, per_host_concurrency=4,
+                 commit_every=1, base_url=WEIBO_URL, adaptive=False, archive_dir=None):
+    global response_archive
+    if archive_dir:
+        response_archive = ResponseArchive(archive_dir)
+    save_channels_to_db(db_session, base_url)
     channels = db_session().query(Channel).all()
     urls = []
-    for i in range(0, 3):
-        for channel in channels:
-            urls.append(url1 + f"{i}" + url2 + f"{channel.gid}" + url3 + f"{channel.containerid}" + url4)
+    plan = None
+    if adaptive:
+        budget = num_requests_per_thread * len(channels) * 3
+        allocation = allocate_requests(channels, budget)
+        plan = {build_channel_url(channel.gid, channel.containerid, 0, channel.since_id, base_url=base_url):
+                allocation[channel.gid] for channel in channels if channel.gid in allocation}
+        urls = list(plan)
+    else:
+        for i in range(0, 3):
+            for channel in channels:
+                urls.append(build_channel_url(channel.gid, channel.containerid, i, channel.since_id,
+                                              base_url=base_url))
     print(urls)
-    multi_thread(db_session, urls, num_requests_per_thread)
+    if mode == 'async':
+        multi_async(db_session, urls, num_requests_per_thread, max_concurrency, per_host_concurrency, plan)
+    elif mode == 'pipeline':
+        from pipeline import multi_pipeline
+        multi_pipeline(db_session, urls, num_requests_per_thread, max_concurrency, commit_every, plan)
+    else:
+        multi_thread(db_session, urls, num_requests_per_thread, commit_every, plan)
+
+    scheduler_session = db_session()
+    apply_crawl_results(scheduler_session)
+    scheduler_session.close()
+
+    if archive_dir:
+        response_archive.close()
+        response_archive = None
@@ -1,11 +1,103 @@
 # 使用jieba提取话题关键词（最多不超过5个），保存到数据库
+import os
+from concurrent.futures import ProcessPoolExecutor
 import jieba
-import jieba.analyse
-from models import Topic, BlogPost
+from sqlalchemy import func, or_
+from idf_model import load_idf_model
+from models import Topic, BlogPost, update_posts
+from token_cache import get_post_tokens
+from topic_aggregates import update_posts_topic_stats
 
 
+# 在已有的分词结果上提取关键词，与 jieba.analyse.extract_tags 的TF-IDF算法一致，避免再次分词
+# idf_model为 idf_model.load_idf_model 加载的语料IDF，为None时使用jieba自带的通用IDF
+# jieba.analyse 导入时会加载IDF表和词性标注模型，耗时约1秒，因此在首次使用时才导入
+def keywords_from_tokens(tokens, topK=10, idf_model=None):
+    import jieba.analyse
+
+    tfidf = jieba.analyse.default_tfidf
+    if idf_model is None:
+        idf_freq, median_idf = tfidf.idf_freq, tfidf.median_idf
+    else:
+        idf_freq, median_idf = idf_model['idf'], idf_model['median_idf']
+    freq = {}
+    for token in tokens:
+        if len(token.strip()) < 2 or token.lower() in tfidf.stop_words:
+            continue
+        freq[token] = freq.get(token, 0.0) + 1.0
+    total = sum(freq.values())
+    for token in freq:
+        freq[token] *= idf_freq.get(token, median_idf) / total
+    return sorted(freq, key=freq.__getitem__, reverse=True)[:topK]
+
+
+# 关键词提取进程池中使用的语料IDF，在进程启动时传入一次
+_worker_idf_model = None
+
+
+def init_keyword_worker(idf_model):
+    global _worker_idf_model
+    _worker_idf_model = idf_model
+
+
+def extract_keywords_chunk(chunk):
+    return [(post_id, keywords_from_tokens(tokens, 10, _worker_idf_model)) for post_id, tokens in chunk]
+
+
+# 尚未提取关键词（keywords为空或null）的SQL条件
+def missing_keywords(column):
+    return or_(column.is_(None), func.json_array_length(column) == 0)
+
+
+# 使用语料IDF提取博文关键词：在SQL中只选出尚未提取关键词的博文（only_missing为False时选出全部博文重新提取），
+# 分词结果从缓存读取，按块在进程池中并行提取后批量写回，并用新旧关键词之差更新所属话题的关键词频数
+def extract_post_keywords_idf(session, idf_model=None, only_missing=True, chunk_size=2000, num_workers=None):
+    query = session.query(BlogPost.id, BlogPost.text, BlogPost.keywords)
+    if only_missing:
+        query = query.filter(missing_keywords(BlogPost.keywords))
+    rows = query.all()
+    if not rows:
+        return 0
+    posts = [(post_id, text) for post_id, text, _ in rows]
+    old_keywords = {post_id: {'keywords': keywords} for post_id, _, keywords in rows}
+
+    idf_model = idf_model or load_idf_model(session)
+    token_lists = get_post_tokens(session, posts)
+    chunks = [[(post_id, token_lists[post_id]) for post_id, _ in posts[offset:offset + chunk_size]]
+              for offset in range(0, len(posts), chunk_size)]
+    if len(chunks) == 1 or num_workers == 1:
+        init_keyword_worker(idf_model)
+        results = map(extract_keywords_chunk, chunks)
+    else:
+        pool = ProcessPoolExecutor(max_workers=num_workers or os.cpu_count(), initializer=init_keyword_worker,
+                                   initargs=(idf_model,))
+        results = list(pool.map(extract_keywords_chunk, chunks))
+        pool.shutdown()
+
+    new_keywords = {}
+    for chunk_result in results:
+        update_posts(session, [{'id': post_id, 'keywords': keywords} for post_id, keywords in chunk_result])
+        new_keywords.update((post_id, {'keywords': keywords}) for post_id, keywords in chunk_result)
+    update_posts_topic_stats(session, removed=old_keywords, added=new_keywords)
+    session.commit()
+    return len(posts)
+
+
+# 使用语料IDF提取话题关键词（最多不超过5个），只处理尚未提取关键词的话题
+def extract_topic_keywords_idf(session, idf_model=None):
+    topics = session.query(Topic).filter(missing_keywords(Topic.keywords)).all()
+    if not topics:
+        return 0
+    idf_model = idf_model or load_idf_model(session)
+    for topic in topics:
+        topic.keywords = keywords_from_tokens(jieba.lcut(topic.topic_title or ''), topK=5, idf_model=idf_model)
+    session.commit()
+    return len(topics)
+
 
 def extract_topic_keywords(session):
+    import jieba.analyse
+
     topics = session.query(Topic).all()
     for topic in topics:
         if len(topic.keywords) == 0:
@@ -14,17 +106,20 @@ def extract_topic_keywords(session):
     session.commit()
 
 
-# 使用jieba提取博文关键词（最多不超过10个），保存到数据库
+# 使用jieba提取博文关键词（最多不超过10个），保存到数据库；分词结果从博文分词缓存中读取
 def extract_post_keywords(session):
-    posts = session.query(BlogPost).all()
-    for post in posts:
-        if len(post.keywords) == 0:
-            keywords = jieba.analyse.extract_tags(post.text, topK=10)
-            post.keywords = keywords
+    posts = [(post_id, text) for post_id, text, keywords in session.query(BlogPost.id, BlogPost.text, BlogPost.keywords)
+             if len(keywords) == 0]
+    token_lists = get_post_tokens(session, posts)
+    new_keywords = {post_id: keywords_from_tokens(token_lists[post_id], topK=10) for post_id, _ in posts}
+    update_posts(session, [{'id': post_id, 'keywords': keywords} for post_id, keywords in new_keywords.items()])
+    update_posts_topic_stats(session, removed={post_id: {'keywords': []} for post_id in new_keywords},
+                             added={post_id: {'keywords': keywords} for post_id, keywords in new_keywords.items()})
     session.commit()
 
 
 def extract_keywords(session):
-    extract_post_keywords(session)
-    extract_topic_keywords(session)
+    idf_model = load_idf_model(session)
+    extract_post_keywords_idf(session, idf_model)
+    extract_topic_keywords_idf(session, idf_model)
 
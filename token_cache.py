@@ -0,0 +1,140 @@
+import threading
+from array import array
+from collections import Counter
+import jieba
+from sqlalchemy import event, insert
+from sqlalchemy.orm import Session as OrmSession
+from models import Token, PostTokens, DocFreq
+
+# 已提交的词表缓存：数据库地址 -> {'ids': 词语 -> id, 'tokens': id -> 词语}
+_vocabularies = {}
+_vocabulary_lock = threading.Lock()
+# SQLite单条语句的参数个数上限较低，IN查询按块执行
+CHUNK_SIZE = 500
+
+
+def vocabulary_key(db_session):
+    return str(db_session.get_bind().url)
+
+
+# 获取数据库对应的词表缓存，首次使用时从数据库加载
+def get_vocabulary(db_session):
+    key = vocabulary_key(db_session)
+    with _vocabulary_lock:
+        if key not in _vocabularies:
+            rows = db_session.query(Token.id, Token.token).all()
+            _vocabularies[key] = {'ids': {token: token_id for token_id, token in rows},
+                                  'tokens': {token_id: token for token_id, token in rows}}
+        return _vocabularies[key]
+
+
+# 丢弃数据库对应的词表缓存（例如整表复制词表之后），下次使用时重新加载
+def reset_vocabulary(db_session):
+    with _vocabulary_lock:
+        _vocabularies.pop(vocabulary_key(db_session), None)
+
+
+# 本会话中新加入词表、尚未提交的词语，提交后才进入共享的词表缓存，回滚时丢弃
+def pending_tokens(db_session):
+    return db_session.info.setdefault('pending_tokens', {})
+
+
+@event.listens_for(OrmSession, 'after_commit')
+def promote_pending_tokens(session):
+    pending = session.info.pop('pending_tokens', None)
+    if pending:
+        with _vocabulary_lock:
+            vocabulary = _vocabularies.get(vocabulary_key(session))
+            if vocabulary is not None:
+                vocabulary['ids'].update(pending)
+                vocabulary['tokens'].update((token_id, token) for token, token_id in pending.items())
+
+
+@event.listens_for(OrmSession, 'after_rollback')
+def discard_pending_tokens(session):
+    session.info.pop('pending_tokens', None)
+
+
+# 将词语转换为词表id，词表中没有的词语批量插入
+def intern_tokens(db_session, token_lists):
+    ids = get_vocabulary(db_session)['ids']
+    pending = pending_tokens(db_session)
+    missing = list({token for tokens in token_lists for token in tokens if token not in ids and token not in pending})
+    for offset in range(0, len(missing), CHUNK_SIZE):
+        chunk = missing[offset:offset + CHUNK_SIZE]
+        db_session.execute(insert(Token).prefix_with('OR IGNORE'), [{'token': token} for token in chunk])
+        pending.update((token, token_id) for token_id, token in
+                       db_session.query(Token.id, Token.token).filter(Token.token.in_(chunk)))
+    return [[ids[token] if token in ids else pending[token] for token in tokens] for tokens in token_lists]
+
+
+def encode_tokens(token_ids):
+    return array('I', token_ids).tobytes()
+
+
+def decode_tokens(db_session, token_ids):
+    tokens = get_vocabulary(db_session)['tokens']
+    pending = {token_id: token for token, token_id in pending_tokens(db_session).items()}
+    return [tokens[token_id] if token_id in tokens else pending[token_id] for token_id in token_ids]
+
+
+# 按博文增减文档频率：token_id_lists为每篇博文的词语id列表，sign为1时增加，为-1时减少。
+# 增减都用同一条upsert语句，参数以元组交给驱动的executemany执行，避免SQLAlchemy逐行处理参数的开销
+def update_doc_freqs(db_session, token_id_lists, sign=1):
+    doc_freqs = Counter(token_id for token_ids in token_id_lists for token_id in set(token_ids))
+    if not doc_freqs:
+        return
+    db_session.connection().exec_driver_sql(
+        f'INSERT INTO {DocFreq.__tablename__} (token_id, doc_freq) VALUES (?, ?) '
+        f'ON CONFLICT (token_id) DO UPDATE SET doc_freq = doc_freq + excluded.doc_freq',
+        [(token_id, sign * count) for token_id, count in doc_freqs.items()])
+
+
+# 读取博文分词缓存中的词语id：返回 博文id -> 词语id数组
+def load_token_ids(db_session, post_ids):
+    post_ids = list(post_ids)
+    result = {}
+    for offset in range(0, len(post_ids), CHUNK_SIZE):
+        chunk = post_ids[offset:offset + CHUNK_SIZE]
+        for post_id, data in db_session.query(PostTokens.post_id, PostTokens.tokens).filter(
+                PostTokens.post_id.in_(chunk)):
+            token_ids = array('I')
+            token_ids.frombytes(data)
+            result[post_id] = token_ids
+    return result
+
+
+# 缓存博文分词结果，并同步更新文档频率：token_lists为 博文id -> 词语列表；replace为True时覆盖已有的缓存
+def cache_post_tokens(db_session, token_lists, replace=False):
+    post_ids = list(token_lists)
+    if replace:
+        delete_post_tokens(db_session, post_ids)
+    encoded = intern_tokens(db_session, [token_lists[post_id] for post_id in post_ids])
+    db_session.add_all([PostTokens(post_id=post_id, tokens=encode_tokens(token_ids))
+                        for post_id, token_ids in zip(post_ids, encoded)])
+    update_doc_freqs(db_session, encoded)
+
+
+# 读取博文分词缓存：返回 博文id -> 词语列表，没有缓存的博文不在结果中
+def load_post_tokens(db_session, post_ids):
+    return {post_id: decode_tokens(db_session, token_ids)
+            for post_id, token_ids in load_token_ids(db_session, post_ids).items()}
+
+
+# 获取博文的分词结果：posts为(博文id, 正文)列表，优先读取缓存，缓存中没有的博文分词后写入缓存
+def get_post_tokens(db_session, posts):
+    result = load_post_tokens(db_session, [post_id for post_id, _ in posts])
+    missing = {post_id: jieba.lcut(text or '') for post_id, text in posts if post_id not in result}
+    if missing:
+        cache_post_tokens(db_session, missing)
+        result.update(missing)
+    return result
+
+
+# 删除博文的分词缓存，并从文档频率中减去这些博文
+def delete_post_tokens(db_session, post_ids):
+    post_ids = list(post_ids)
+    update_doc_freqs(db_session, load_token_ids(db_session, post_ids).values(), sign=-1)
+    for offset in range(0, len(post_ids), CHUNK_SIZE):
+        db_session.query(PostTokens).filter(PostTokens.post_id.in_(post_ids[offset:offset + CHUNK_SIZE])).delete(
+            synchronize_session=False)
@@ -0,0 +1,277 @@
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from sqlalchemy import select
+from data_analysis import get_topics_for_posts
+from models import BlogPost, Topic, TopicPost, Weight
+from topic_hot_rate import calculate_hot_rate, get_weight
+
+# 热度时间变化按3小时一段，共24段（72小时）；分段边界对齐到BUCKET_EPOCH起每3小时的整点，
+# 这样没有变化的话题在之后的更新中只需按经过的段数平移，不必重新读取博文
+BUCKET = timedelta(hours=3)
+NUM_BUCKETS = 24
+BUCKET_EPOCH = datetime(2000, 1, 1)
+
+
+# 单个话题的累加统计量
+def new_topic_stats():
+    return {'post_count': 0, 'posts': 0, 'likes': 0, 'comments': 0, 'reposts': 0,
+            'emotion_sums': defaultdict(float), 'emotion_counts': defaultdict(int), 'keywords': Counter()}
+
+
+# 一次读取博文和话题关联，在一遍遍历中同时累加话题的统计量：
+# 博文数、点赞/评论/转发总数、各情感强度之和与出现次数、关键词频数；topic_uuids为None时统计所有话题，
+# post_filter不为None时只统计满足该条件的博文
+def aggregate_topics(session_db, topic_uuids=None, post_filter=None):
+    links = session_db.query(TopicPost.topic_uuid, TopicPost.post_id)
+    posts = session_db.query(BlogPost.id, BlogPost.likes_count, BlogPost.comments_count, BlogPost.reposts_count,
+                             BlogPost.keywords, BlogPost.emotion)
+    if post_filter is not None:
+        links = links.filter(TopicPost.post_id.in_(select(BlogPost.id).where(post_filter)))
+        posts = posts.filter(post_filter)
+    if topic_uuids is not None:
+        links = links.filter(TopicPost.topic_uuid.in_(list(topic_uuids)))
+        posts = posts.filter(BlogPost.id.in_(links.with_entities(TopicPost.post_id)))
+    posts = {post_id: values for post_id, *values in posts}
+
+    stats = defaultdict(new_topic_stats)
+    for topic_uuid, post_id in links:
+        topic_stats = stats[topic_uuid]
+        topic_stats['post_count'] += 1
+        post = posts.get(post_id)
+        if post is None:
+            continue
+        likes, comments, reposts, keywords, emotion = post
+        topic_stats['posts'] += 1
+        topic_stats['likes'] += likes
+        topic_stats['comments'] += comments
+        topic_stats['reposts'] += reposts
+        for name, intensity in (emotion or {}).items():
+            topic_stats['emotion_sums'][name] += intensity
+            topic_stats['emotion_counts'][name] += 1
+        topic_stats['keywords'].update(keywords or [])
+    return stats
+
+
+# 由累加的统计量得到话题的累加字段，以及 post_count、avg_*、emotion 和 post_keywords
+def topic_attributes(topic_stats):
+    posts = topic_stats['posts']
+    return {
+        'post_count': topic_stats['post_count'],
+        'likes_sum': topic_stats['likes'],
+        'comments_sum': topic_stats['comments'],
+        'reposts_sum': topic_stats['reposts'],
+        'emotion_sums': {name: [total, topic_stats['emotion_counts'][name]]
+                         for name, total in topic_stats['emotion_sums'].items()},
+        'avg_likes': topic_stats['likes'] / posts if posts else 0,
+        'avg_comments': topic_stats['comments'] / posts if posts else 0,
+        'avg_reposts': topic_stats['reposts'] / posts if posts else 0,
+        'emotion': {name: total / topic_stats['emotion_counts'][name]
+                    for name, total in topic_stats['emotion_sums'].items()},
+        'post_keywords': dict(topic_stats['keywords']),
+        'dirty': True
+    }
+
+
+# 从头重建话题的累加统计量及由其得到的字段并批量写回，topic_uuids为None时重建所有话题
+def rebuild_topic_stats(session_db, topic_uuids=None):
+    stats = aggregate_topics(session_db, topic_uuids)
+    if topic_uuids is None:
+        topic_uuids = [row[0] for row in session_db.query(Topic.uuid)]
+    empty = new_topic_stats()
+    session_db.bulk_update_mappings(Topic, [dict(uuid=topic_uuid, **topic_attributes(stats.get(topic_uuid, empty)))
+                                            for topic_uuid in topic_uuids])
+    session_db.commit()
+    return len(topic_uuids)
+
+
+# 尚未开始维护累加统计量的话题（旧数据库中的话题）
+def untracked_topic_uuids(session_db):
+    return [row[0] for row in session_db.query(Topic.uuid).filter(Topic.likes_sum.is_(None))]
+
+
+# 博文中参与话题统计的字段
+POST_VALUE_FIELDS = ('likes_count', 'comments_count', 'reposts_count', 'emotion', 'keywords')
+
+
+def post_values(post):
+    return {field: getattr(post, field) for field in POST_VALUE_FIELDS}
+
+
+# 增量更新话题的累加统计量：removed中的博文移出，added中的博文计入（博文为字段字典，缺少的字段视为0或空）
+def update_topic_stats(topic, removed=(), added=()):
+    delta = new_topic_stats()
+    for sign, posts in ((-1, removed), (1, added)):
+        for post in posts:
+            delta['post_count'] += sign
+            delta['likes'] += sign * (post.get('likes_count') or 0)
+            delta['comments'] += sign * (post.get('comments_count') or 0)
+            delta['reposts'] += sign * (post.get('reposts_count') or 0)
+            for name, intensity in (post.get('emotion') or {}).items():
+                delta['emotion_sums'][name] += sign * intensity
+                delta['emotion_counts'][name] += sign
+            for keyword in post.get('keywords') or []:
+                delta['keywords'][keyword] += sign
+    apply_topic_stats(topic, delta)
+
+
+# 将统计量的变化（形式同 new_topic_stats，sign为-1时减去）计入话题的累加统计量，
+# 并由累加值直接得到 post_count、avg_*、emotion 和 post_keywords；尚未维护累加统计量的话题只更新post_count。
+# 话题同时被标记为dirty，下一次更新话题统计时重新计算
+def apply_topic_stats(topic, delta, sign=1):
+    topic.dirty = True
+    topic.post_count = (topic.post_count or 0) + sign * delta['post_count']
+    if topic.likes_sum is None:
+        return
+
+    emotion_sums = {name: list(entry) for name, entry in (topic.emotion_sums or {}).items()}
+    for name, total in delta['emotion_sums'].items():
+        entry = emotion_sums.setdefault(name, [0.0, 0])
+        entry[0] += sign * total
+        entry[1] += sign * delta['emotion_counts'][name]
+    keywords = Counter(topic.post_keywords or {})
+    for keyword, count in delta['keywords'].items():
+        keywords[keyword] += sign * count
+
+    post_count = topic.post_count
+    topic.likes_sum = topic.likes_sum + sign * delta['likes']
+    topic.comments_sum = (topic.comments_sum or 0) + sign * delta['comments']
+    topic.reposts_sum = (topic.reposts_sum or 0) + sign * delta['reposts']
+    topic.avg_likes = topic.likes_sum / post_count if post_count > 0 else 0
+    topic.avg_comments = topic.comments_sum / post_count if post_count > 0 else 0
+    topic.avg_reposts = topic.reposts_sum / post_count if post_count > 0 else 0
+    topic.emotion_sums = {name: entry for name, entry in emotion_sums.items() if entry[1] > 0}
+    topic.emotion = {name: total / count for name, (total, count) in topic.emotion_sums.items()}
+    topic.post_keywords = {keyword: count for keyword, count in keywords.items() if count > 0}
+
+
+# 按博文增量更新其所属话题的累加统计量：removed/added为 博文id -> 字段字典
+def update_posts_topic_stats(session_db, removed=None, added=None):
+    removed, added = removed or {}, added or {}
+    post_topics = get_topics_for_posts(session_db, set(removed) | set(added))
+    changes = defaultdict(lambda: ([], []))
+    for index, posts in enumerate((removed, added)):
+        for post_id, values in posts.items():
+            for topic_uuid in post_topics.get(post_id, []):
+                changes[topic_uuid][index].append(values)
+
+    topic_uuids = list(changes)
+    for offset in range(0, len(topic_uuids), 500):
+        for topic in session_db.query(Topic).filter(Topic.uuid.in_(topic_uuids[offset:offset + 500])):
+            update_topic_stats(topic, *changes[topic.uuid])
+
+
+# 自上次更新话题统计以来相关博文有变化的话题（dirty为NULL的旧数据也视为有变化）
+def dirty_topics():
+    return Topic.dirty.isnot(False)
+
+
+def dirty_topic_uuids(session_db):
+    return [row[0] for row in session_db.query(Topic.uuid).filter(dirty_topics())]
+
+
+# 话题统计全部更新完成后清除dirty标记
+def clear_dirty_topics(session_db):
+    session_db.query(Topic).filter(dirty_topics()).update({Topic.dirty: False}, synchronize_session=False)
+    session_db.commit()
+
+
+# now所在3小时段的结束时刻，即第0段的结束时刻
+def bucket_anchor(now):
+    return BUCKET_EPOCH + ((now - BUCKET_EPOCH) // BUCKET + 1) * BUCKET
+
+
+# 第i段为 [anchor - (i+1)*3小时, anchor - i*3小时) 之间发布的博文，超出72小时或晚于anchor时返回None
+def bucket_index(anchor, date):
+    if date is None or date >= anchor:
+        return None
+    bucket = (anchor - date) // BUCKET
+    return bucket if bucket < NUM_BUCKETS else None
+
+
+# 由每3小时的博文数和互动总数计算话题的热度时间变化：buckets为 段号 -> [博文数, 点赞, 评论, 转发]
+def hot_rate_per_hr_from_buckets(buckets, weights):
+    hot_rate_per_hr = {}
+    for i in range(NUM_BUCKETS):
+        count, likes, comments, reposts = buckets.get(i, (0, 0, 0, 0))
+        hot_rate_per_hr[i] = calculate_hot_rate(count, likes / count, comments / count, reposts / count,
+                                                *weights) if count else 0
+    return hot_rate_per_hr
+
+
+# 将anchor_at时计算的热度时间变化平移到anchor：经过k段后原第i段成为第i+k段，新的前k段没有博文
+def shift_hot_rate_per_hr(hot_rate_per_hr, anchor_at, anchor):
+    shift = (anchor - anchor_at) // BUCKET
+    if shift <= 0:
+        return None
+    old = {int(i): value for i, value in hot_rate_per_hr.items()}
+    return {i: old.get(i - shift, 0) if i >= shift else 0 for i in range(NUM_BUCKETS)}
+
+
+# 将没有变化的话题的热度时间变化平移到anchor，返回需要写回的映射
+def shift_clean_hot_rates(session_db, anchor):
+    mappings = []
+    for topic_uuid, hot_rate_per_hr, anchor_at in session_db.query(
+            Topic.uuid, Topic.hot_rate_per_hr, Topic.hot_rate_per_hr_at).filter(
+            Topic.dirty == False, Topic.hot_rate_per_hr_at.isnot(None)):
+        shifted = shift_hot_rate_per_hr(hot_rate_per_hr or {}, anchor_at, anchor)
+        if shifted is not None:
+            mappings.append({'uuid': topic_uuid, 'hot_rate_per_hr': shifted, 'hot_rate_per_hr_at': anchor})
+    return mappings
+
+
+# 更新话题的 hot_rate 和 hot_rate_per_hr。只处理有变化的话题和尚未计算过热度时间变化的话题：
+# hot_rate由已维护的post_count和avg_*直接得到；hot_rate_per_hr一次读取这些话题相关博文的发布时间和互动数，
+# 按话题、按3小时分段累加。没有变化的话题hot_rate不变，hot_rate_per_hr按经过的段数平移，
+# 因此 update_topics_stage 看到的所有话题都对齐到同一时刻。首次计算热度权重时所有话题都重新计算
+def update_topics_hot_rates(session_db, now=None):
+    anchor = bucket_anchor(now or datetime.now())
+    full = session_db.query(Weight).first() is None
+    weights = get_weight(session_db)
+
+    changed = Topic.uuid.in_(select(Topic.uuid).where(dirty_topics() | Topic.hot_rate_per_hr_at.is_(None)))
+    links = session_db.query(TopicPost.topic_uuid, BlogPost.date, BlogPost.likes_count, BlogPost.comments_count,
+                             BlogPost.reposts_count).join(BlogPost, BlogPost.id == TopicPost.post_id)
+    topics = session_db.query(Topic.uuid, Topic.post_count, Topic.avg_likes, Topic.avg_comments, Topic.avg_reposts)
+    if not full:
+        links = links.filter(TopicPost.topic_uuid.in_(select(Topic.uuid).where(changed)))
+        topics = topics.filter(changed)
+
+    # 有相关博文的话题都有一项，博文都不在72小时内时该话题的热度时间变化全部为0
+    buckets = defaultdict(dict)
+    for topic_uuid, date, likes, comments, reposts in links:
+        topic_buckets = buckets[topic_uuid]
+        bucket = bucket_index(anchor, date)
+        if bucket is not None:
+            bucket_stats = topic_buckets.setdefault(bucket, [0, 0, 0, 0])
+            bucket_stats[0] += 1
+            bucket_stats[1] += likes
+            bucket_stats[2] += comments
+            bucket_stats[3] += reposts
+
+    mappings = [] if full else shift_clean_hot_rates(session_db, anchor)
+    for topic_uuid, post_count, avg_likes, avg_comments, avg_reposts in topics:
+        mapping = {'uuid': topic_uuid,
+                   'hot_rate': calculate_hot_rate(post_count, avg_likes, avg_comments, avg_reposts, *weights)}
+        # 没有相关博文的话题保留原有的热度时间变化
+        if topic_uuid in buckets:
+            mapping['hot_rate_per_hr'] = hot_rate_per_hr_from_buckets(buckets[topic_uuid], weights)
+            mapping['hot_rate_per_hr_at'] = anchor
+        mappings.append(mapping)
+    session_db.bulk_update_mappings(Topic, mappings)
+    session_db.commit()
+    return len(mappings)
+
+
+# 从头计算并批量写回所有话题的统计字段，代替逐个话题、逐个字段查询博文的基线实现
+# （见 benchmark.baseline_topic_stats）。
+# 先写回平均值：首次计算热度权重时，get_weight 对话题的平均值做主成分分析
+def update_topics_aggregates(session_db, now=None):
+    rebuild_topic_stats(session_db)
+    return update_topics_hot_rates(session_db, now)
+
+
+if __name__ == '__main__':
+    from models import load_database
+
+    session = load_database()
+    print(f"重建{rebuild_topic_stats(session)}个话题的累加统计量")
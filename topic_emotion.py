@@ -1,12 +1,21 @@
+import hashlib
+import os
+import pickle
+import time
 from collections import defaultdict
+from datetime import datetime, timedelta
 import jieba
-import pandas as pd
 from data_analysis import get_blogposts_for_topic
-from models import Topic
+from models import BlogPost, load_database, update_posts
+
+EMOTION_DICT_PATH = os.path.join(os.path.dirname(__file__), "emotionDict.xlsx")  # 情感词典
+EMOTION_CACHE_PATH = os.path.join(os.path.dirname(__file__), "emotionDict.pkl")  # 编译后的情感词典缓存
 
 
 # 读取情感词典
 def load_emotion_dict(filepath):
+    import pandas as pd
+
     emotion_df = pd.read_excel(filepath)  # 通过 pd.read_excel() 函数读取指定路径下的 Excel 文件
     emotion_dictionary = {}  # 创建一个空字典，用来存储情感词典数据
     for _, row in emotion_df.iterrows():  # 使用 emotion_df.iterrows() 迭代每一行数据
@@ -17,8 +26,75 @@ def load_emotion_dict(filepath):
     return emotion_dictionary  # 返回完整的情感词典字典
 
 
-# 调用 load_emotion_dict 函数，传入 Excel 文件的路径作为参数，加载情感词典数据
-emotion_dict = load_emotion_dict("emotionDict.xlsx")
+# 计算情感词典文件的sha1，用于在修改时间变化时判断内容是否真的改变
+def file_sha1(filepath):
+    with open(filepath, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+# 写入编译后的情感词典缓存：先写临时文件再原子替换，读取方不会读到写了一半的缓存；
+# 临时文件名带进程号，NLP进程池中的多个进程同时重新编译时互不干扰
+def save_emotion_table(table, cache_path):
+    tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(table, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, cache_path)
+
+
+# 将xlsx情感词典编译为紧凑的查找表：categories为情感分类名列表，words为 词语 -> (情感分类序号, 强度)
+def compile_emotion_dict(filepath=EMOTION_DICT_PATH, cache_path=EMOTION_CACHE_PATH):
+    emotion_dictionary = load_emotion_dict(filepath)
+    categories = sorted({values['情感分类'] for values in emotion_dictionary.values()})
+    category_ids = {category: i for i, category in enumerate(categories)}
+    table = {
+        'mtime': os.stat(filepath).st_mtime_ns,
+        'size': os.stat(filepath).st_size,
+        'sha1': file_sha1(filepath),
+        'categories': categories,
+        'words': {word: (category_ids[values['情感分类']], int(values['强度']))
+                  for word, values in emotion_dictionary.items()}
+    }
+    save_emotion_table(table, cache_path)
+    return table
+
+
+# 读取编译后的情感词典；缓存不存在、无法读取或已损坏，或xlsx的修改时间/大小变化且内容哈希也变化时重新编译
+def load_emotion_table(filepath=EMOTION_DICT_PATH, cache_path=EMOTION_CACHE_PATH):
+    try:
+        with open(cache_path, 'rb') as f:
+            table = pickle.load(f)
+    except Exception:
+        table = None
+    if not isinstance(table, dict) or not {'mtime', 'size', 'sha1', 'categories', 'words'} <= table.keys():
+        return compile_emotion_dict(filepath, cache_path)
+    stat = os.stat(filepath)
+    if (table['mtime'], table['size']) != (stat.st_mtime_ns, stat.st_size):
+        if table['sha1'] != file_sha1(filepath):
+            return compile_emotion_dict(filepath, cache_path)
+        table['mtime'], table['size'] = stat.st_mtime_ns, stat.st_size
+        save_emotion_table(table, cache_path)
+    return table
+
+
+_emotion_table = None
+
+
+# 首次使用时才加载情感词典
+def get_emotion_table():
+    global _emotion_table
+    if _emotion_table is None:
+        _emotion_table = load_emotion_table()
+    return _emotion_table
+
+
+# 兼容原有的 emotion_dict（词语 -> {'情感分类', '强度'}），在首次访问时由编译后的词典生成
+def __getattr__(name):
+    if name == 'emotion_dict':
+        table = get_emotion_table()
+        categories = table['categories']
+        return {word: {'情感分类': categories[category_id], '强度': intensity}
+                for word, (category_id, intensity) in table['words'].items()}
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 # 使用情感词典进行情感分析
@@ -32,13 +108,16 @@ def analyze_sentiment(words):
     # 初始化emotion_proportions为空字典
     emotion_proportions = {}
 
+    table = get_emotion_table()
+    emotion_words = table['words']
+    categories = table['categories']
+
     # 遍历分词后的单词列表
     for word in words:
         # 先判断单词是否在情感词典中
-        if word in emotion_dict:
-            values = emotion_dict[word]
-            emotion = values['情感分类']
-            intensity = values['强度']
+        if word in emotion_words:
+            category_id, intensity = emotion_words[word]
+            emotion = categories[category_id]
 
             # 将当前单词的强度值累加到总强度
             total_intensity += intensity
@@ -49,12 +128,93 @@ def analyze_sentiment(words):
             else:
                 emotion_intensity[emotion] = intensity
 
-        # 计算每个情感类别在总强度中的比例
+    # 计算每个情感类别在总强度中的比例
+    if emotion_intensity:
         emotion_proportions = {emotion: intensity / total_intensity for emotion, intensity in emotion_intensity.items()}
 
     return emotion_proportions
 
 
+# 情感词×情感分类的强度矩阵与出现矩阵（强度为0的情感词也计入出现），行顺序与情感词典中词语的顺序一致
+def build_emotion_matrix(table):
+    import numpy as np
+    from scipy import sparse
+
+    vocabulary = {word: i for i, word in enumerate(table['words'])}
+    rows = np.arange(len(vocabulary))
+    category_ids = np.fromiter((category_id for category_id, _ in table['words'].values()), dtype=np.int64)
+    intensities = np.fromiter((intensity for _, intensity in table['words'].values()), dtype=np.float64)
+    shape = (len(vocabulary), len(table['categories']))
+    intensity_matrix = sparse.csr_matrix((intensities, (rows, category_ids)), shape=shape)
+    presence_matrix = sparse.csr_matrix((np.ones(len(vocabulary)), (rows, category_ids)), shape=shape)
+    return vocabulary, intensity_matrix, presence_matrix
+
+
+_emotion_matrix = None
+
+
+# 情感词典的矩阵形式与加载的情感词典一起缓存，只在情感词典（重新）加载后构造一次
+def get_emotion_matrix():
+    global _emotion_matrix
+    table = get_emotion_table()
+    if _emotion_matrix is None or _emotion_matrix[0] is not table:
+        _emotion_matrix = (table, build_emotion_matrix(table))
+    return _emotion_matrix[1]
+
+
+# 批量计算情感：将分词结果转换为 博文×情感词 的稀疏计数矩阵，乘以强度矩阵后按行归一化。
+# 结果与逐条调用 analyze_sentiment 相同
+def batch_sentiment(token_lists):
+    import numpy as np
+    from scipy import sparse
+
+    vocabulary, intensity_matrix, presence_matrix = get_emotion_matrix()
+    categories = get_emotion_table()['categories']
+
+    indptr = [0]
+    indices = []
+    for tokens in token_lists:
+        indices.extend(vocabulary[token] for token in tokens if token in vocabulary)
+        indptr.append(len(indices))
+    counts = sparse.csr_matrix((np.ones(len(indices)), indices, indptr), shape=(len(token_lists), len(vocabulary)))
+
+    intensity = (counts @ intensity_matrix).toarray()
+    presence = (counts @ presence_matrix).toarray() > 0
+    totals = intensity.sum(axis=1, keepdims=True)
+    proportions = intensity / np.where(totals == 0, 1, totals)
+
+    return [{categories[j]: float(proportions[i, j]) for j in np.flatnonzero(presence[i])}
+            for i in range(len(token_lists))]
+
+
+# 修改情感词典后批量重新计算最近hours小时内博文的情感，并批量写回BlogPost.emotion；
+# update_topics为True时随后重建话题的累加统计量，使Topic.emotion与新的博文情感一致
+# 分词结果默认从博文分词缓存读取，也可以通过tokenizer指定分词函数
+def rescore_emotions(session_db, hours=72, tokenizer=None, chunk_size=5000, update_topics=True):
+    from token_cache import get_post_tokens
+
+    time_start = time.time()
+    since = datetime.now() - timedelta(hours=hours)
+    posts = session_db.query(BlogPost.id, BlogPost.text).filter(BlogPost.date >= since).all()
+
+    for offset in range(0, len(posts), chunk_size):
+        chunk = posts[offset:offset + chunk_size]
+        if tokenizer is None:
+            token_lists = get_post_tokens(session_db, chunk)
+            emotions = batch_sentiment([token_lists[post_id] for post_id, _ in chunk])
+        else:
+            emotions = batch_sentiment([tokenizer(text or '') for _, text in chunk])
+        update_posts(session_db, [{'id': post_id, 'emotion': emotion}
+                                  for (post_id, _), emotion in zip(chunk, emotions)])
+    session_db.commit()
+    if update_topics:
+        from topic_aggregates import rebuild_topic_stats
+        rebuild_topic_stats(session_db)
+
+    print(f"重新计算{len(posts)}条博文的情感，用时{time.time() - time_start:.2f}s")
+    return len(posts)
+
+
 # 对文本进行分词
 def segment_text(text):
     return list(jieba.cut(text))
@@ -77,9 +237,5 @@ def calculate_average_emotions(session_db, topic_uuid):
     return average_emotions
 
 
-# 对所有topic的emotion进行更新
-def update_topics_emotions(session_db):
-    topics = session_db.query(Topic).all()
-    for topic in topics:
-        topic.emotion = calculate_average_emotions(session_db, topic.uuid)
-    session_db.commit()
+if __name__ == '__main__':
+    rescore_emotions(load_database())
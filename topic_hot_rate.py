@@ -1,5 +1,3 @@
-import numpy as np
-from sklearn.decomposition import PCA
 from data_analysis import calculate_average_likes_count, calculate_average_comments_count, \
     calculate_average_reposts_count
 from models import Topic, Weight
@@ -24,6 +22,9 @@ def analyze_all_topics(session_db):
 
 # 使用主成分分析法获取权重
 def determine_weights_pca(all_post_counts, all_avg_likes, all_avg_comments, all_avg_reposts):
+    import numpy as np
+    from sklearn.decomposition import PCA
+
     # 准备数据
     X = np.column_stack([all_post_counts, all_avg_likes, all_avg_comments, all_avg_reposts])
 
@@ -0,0 +1,76 @@
+# 每批检索的博文数，限制一批候选话题对占用的内存
+SEARCH_BATCH_POSTS = 10000
+
+
+# 由话题矩阵建立倒排索引：postings为 词 × 话题 的稀疏矩阵，每行是一个词的倒排表（出现该词的话题及该词在话题向量中的权重），
+# max_weights为每个词在所有话题中的最大权重，用于估计博文与话题得分的上界
+def build_topic_index(topic_vectors):
+    import numpy as np
+
+    topics = topic_vectors.tocsr()
+    postings = topics.T.tocsr()
+    if postings.shape[1]:
+        max_weights = postings.max(axis=1).toarray().ravel()
+    else:
+        max_weights = np.zeros(postings.shape[0])
+    return {'topics': topics, 'postings': postings, 'max_weights': max_weights}
+
+
+# 检索一批博文向量（已L2归一化）与话题的余弦相似度高于threshold的话题，按MaxScore剪枝：
+# 每条博文的词按得分上界（博文权重 × 该词在话题中的最大权重）从小到大累加，累加和不超过threshold的词为非必要词，
+# 只含非必要词的话题得分不可能超过threshold。因此只遍历必要词的倒排表得到候选话题和部分得分，
+# 部分得分加上非必要词的上界仍不超过threshold的候选直接丢弃，其余候选再补上非必要词的得分得到精确的余弦相似度。
+# 返回 (博文下标, 话题下标, 相似度) 三个数组
+def search_batch(index, post_vectors, threshold):
+    import numpy as np
+
+    posts = post_vectors.tocsr()
+    posts.sum_duplicates()
+    num_posts = posts.shape[0]
+    rows = np.repeat(np.arange(num_posts), np.diff(posts.indptr))
+    bounds = posts.data * index['max_weights'][posts.indices]
+    order = np.lexsort((bounds, rows))
+    cumulative = np.cumsum(bounds[order])
+    row_offsets = np.concatenate([[0], cumulative])[posts.indptr[:-1]]
+    essential = np.empty(len(bounds), dtype=bool)
+    essential[order] = cumulative - row_offsets[rows[order]] > threshold
+    rest_bounds = np.bincount(rows[~essential], bounds[~essential], minlength=num_posts)
+
+    essential_posts = posts.copy()
+    essential_posts.data[~essential] = 0
+    essential_posts.eliminate_zeros()
+    partial = (essential_posts @ index['postings']).tocoo()
+    post_rows, topic_columns, scores = partial.row, partial.col, partial.data
+    keep = scores + rest_bounds[post_rows] > threshold
+    post_rows, topic_columns, scores = post_rows[keep], topic_columns[keep], scores[keep]
+
+    rest_posts = posts - essential_posts
+    if rest_posts.nnz and len(scores):
+        scores = scores + np.asarray(rest_posts[post_rows].multiply(index['topics'][topic_columns]).sum(axis=1)).ravel()
+    passed = scores > threshold
+    return post_rows[passed], topic_columns[passed], scores[passed]
+
+
+# 在倒排索引中检索每条博文相似度最高的top_k个、且相似度高于threshold的话题，博文按SEARCH_BATCH_POSTS分批检索。
+# 返回按博文顺序、相似度从高到低排列的 (博文下标, 话题下标, 相似度) 三个数组
+def search_topic_index(index, post_vectors, threshold, top_k):
+    import numpy as np
+
+    post_vectors = post_vectors.tocsr()
+    results = []
+    for offset in range(0, post_vectors.shape[0], SEARCH_BATCH_POSTS):
+        post_rows, topic_columns, scores = search_batch(index, post_vectors[offset:offset + SEARCH_BATCH_POSTS],
+                                                        threshold)
+        results.append((post_rows + offset, topic_columns, scores))
+    if not results:
+        return np.array([], dtype=int), np.array([], dtype=int), np.array([])
+    post_rows, topic_columns, scores = (np.concatenate(arrays) for arrays in zip(*results))
+
+    if not len(post_rows):
+        return post_rows, topic_columns, scores
+    order = np.lexsort((topic_columns, -scores, post_rows))
+    post_rows, topic_columns, scores = post_rows[order], topic_columns[order], scores[order]
+    starts = np.flatnonzero(np.concatenate([[True], post_rows[1:] != post_rows[:-1]]))
+    ranks = np.arange(len(post_rows)) - np.repeat(starts, np.diff(np.append(starts, len(post_rows))))
+    top = ranks < top_k
+    return post_rows[top], topic_columns[top], scores[top]
@@ -1,31 +1,43 @@
-import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from sqlalchemy import or_
-from machine_learning import prediction, training
-from models import Topic, BlogPost, load_database
+from sqlalchemy import select
+from data_analysis import get_topics_for_posts
+from models import Topic, BlogPost, TopicPost, load_database
+from topic_aggregates import POST_VALUE_FIELDS, post_values, update_topic_stats
+from topic_index import search_topic_index
+from topic_vectors import load_topic_vectors, topic_vectors_path
 
-session_db = load_database()
+# 每条博文最多匹配的话题数
+MATCH_TOP_K = 5
+# TF-IDF匹配的默认相似度阈值
+MATCH_THRESHOLD = 0.5
 
 
-def prepare_data_for_training(blogposts, topics):
+# post_topics: 博文id -> 相关话题uuid列表
+def prepare_data_for_training(blogposts, topics, post_topics):
     X = []
     y = []
     topic_dict = {topic.uuid: " ".join(topic.keywords) for topic in topics}
     for bp in blogposts:
-        if bp.topics:
+        if post_topics.get(bp.id):
             keywords_str = " ".join(bp.keywords)
-            for topic in bp.topics:
-                if str(topic['uuid']) in topic_dict:
+            for topic_uuid in post_topics[bp.id]:
+                if str(topic_uuid) in topic_dict:
                     X.append(keywords_str)
-                    y.append(topic_dict[str(topic['uuid'])])
+                    y.append(topic_dict[str(topic_uuid)])
     return X, y
 
 
-# 匹配话题到博文（AI版本，弃用）
+# 没有关联任何话题的博文
+def posts_without_topic():
+    return ~BlogPost.id.in_(select(TopicPost.post_id))
+
+
+# 匹配话题到博文（AI版本，弃用）；torch和transformers导入很慢，只在调用时导入
 def match_topics_to_blogposts_ai_ver(threshold=0.5):
+    from machine_learning import prediction, training
+
+    session_db = load_database()
     # 获取所有没有话题的BlogPost
-    blogposts_without_topic = session_db.query(BlogPost).filter(BlogPost.topics == []).all()
+    blogposts_without_topic = session_db.query(BlogPost).filter(posts_without_topic()).all()
     topics = session_db.query(Topic).all()
 
     if not blogposts_without_topic or not topics:
@@ -33,26 +45,61 @@ def match_topics_to_blogposts_ai_ver(threshold=0.5):
         return
 
     # 获取所有有话题的BlogPost用于训练
-    blogposts_with_topics = session_db.query(BlogPost).filter(
-        BlogPost.topics != []
-    ).all()
+    blogposts_with_topics = session_db.query(BlogPost).filter(~posts_without_topic()).all()
+    post_topics = get_topics_for_posts(session_db, [bp.id for bp in blogposts_with_topics])
 
     X_new = []
     for bp in blogposts_without_topic:
         keywords_str = " ".join(bp.keywords)
         X_new.append(keywords_str)
     # 准备训练数据
-    X_train, y_train = prepare_data_for_training(blogposts_with_topics, topics)
+    X_train, y_train = prepare_data_for_training(blogposts_with_topics, topics, post_topics)
     training(X_train, y_train)
     y_new = prediction(X_new, y_train)
     print(f"训练集长度: X: {len(X_train)}, Y: {len(y_train)}")
 
 
-def match_topics_to_blogposts(session, threshold=0.5):
-    # 获取所有没有话题的BlogPost
-    blogposts = session.query(BlogPost).filter(
-        or_(BlogPost.topics.is_(None), BlogPost.topics == [])
-    ).all()
+# 批量匹配博文与话题：所有博文关键词一次向量化为稀疏矩阵，在话题的倒排索引（build_topic_index，随话题矩阵缓存）中
+# 检索每条博文余弦相似度最高的top_k个、且高于阈值的话题（只遍历与博文有共同关键词的话题，见topic_index）；
+# 通过阈值的少量候选再检查话题关键词是否出现在博文关键词中。返回按博文顺序、相似度从高到低的 (博文下标, 话题下标) 列表
+def match_keyword_strings(vectorizer, topic_index, topic_keywords, post_strings, threshold=MATCH_THRESHOLD,
+                          top_k=MATCH_TOP_K):
+    post_rows, topic_columns, _ = search_topic_index(topic_index, vectorizer.transform(post_strings), threshold,
+                                                     top_k)
+    matches = []
+    for post_index, topic_index in zip(post_rows.tolist(), topic_columns.tolist()):
+        if any(kw in post_strings[post_index] for kw in topic_keywords[topic_index]):
+            matches.append((post_index, topic_index))
+    return matches
+
+
+# 用常驻的BERT推理服务匹配博文与话题（TF-IDF匹配的替代）：博文经服务的队列动态组批编码，话题向量在服务中缓存，
+# 按批计算余弦相似度后再做与TF-IDF匹配相同的关键词检查。threshold为None时与prediction一样只取相似度最高的话题，
+# 否则取相似度最高的top_k个且高于threshold的话题。返回格式与match_keyword_strings相同
+def match_keyword_strings_bert(service, topic_keywords, post_strings, threshold=None, top_k=MATCH_TOP_K):
+    import torch
+
+    labels = service.labels_matrix([" ".join(keywords) for keywords in topic_keywords])
+    if threshold is None:
+        top_k, threshold = 1, float('-inf')
+    top_k = min(top_k, labels.shape[0])
+    matches = []
+    for offset in range(0, len(post_strings), service.max_batch_size):
+        similarities = service.embed(post_strings[offset:offset + service.max_batch_size]) @ labels.T
+        top_similarities, top = torch.topk(similarities, top_k, dim=1)
+        for row, column in (top_similarities > threshold).nonzero().tolist():
+            post_index, topic_index = offset + row, top[row, column].item()
+            if any(kw in post_strings[post_index] for kw in topic_keywords[topic_index]):
+                matches.append((post_index, topic_index))
+    return matches
+
+
+# 匹配没有话题的博文：默认使用TF-IDF倒排索引匹配，use_bert为True时使用常驻的BERT推理服务
+# （threshold为None时TF-IDF匹配使用MATCH_THRESHOLD，BERT匹配只取最相似的话题）
+def match_topics_to_blogposts(session, threshold=None, use_bert=False):
+    # 获取所有没有话题且有关键词的博文，只读取匹配和累加统计量需要的字段
+    blogposts = [post for post in session.query(BlogPost.id, *[getattr(BlogPost, field) for field in POST_VALUE_FIELDS])
+                 .filter(posts_without_topic()) if post.keywords]
 
     # 获取所有已知的Topic
     topics = session.query(Topic).all()
@@ -61,41 +108,29 @@ def match_topics_to_blogposts(session, threshold=0.5):
         print("没有需要匹配的话题或博文。")
         return
 
-    # 向量化所有话题关键词
-    topic_keywords = [" ".join(topic.keywords) for topic in topics]
-    vectorizer = TfidfVectorizer()
-    topic_vectors = vectorizer.fit_transform(topic_keywords)
-
-    # 对没有话题的BlogPost进行预测
-    for bp in blogposts:
-        if not bp.keywords:
-            continue
-
-        keywords_str = " ".join(bp.keywords)
-
-        # 向量化博文关键词
-        blogpost_vector = vectorizer.transform([keywords_str])
-
-        # 计算余弦相似度
-        similarities = cosine_similarity(blogpost_vector, topic_vectors).flatten()
-
-        # 选择与博文关键词最相关的关键词，限制关键词数量不超过5个
-        related_topic_indices = np.argsort(similarities)[-5:][::-1]
-        related_topics = [(topics[i], similarities[i]) for i in related_topic_indices if similarities[i] > threshold]
-
-        for topic, similarity in related_topics:
-            if any(kw in keywords_str for kw in topic.keywords):
-                if bp.topics is None:
-                    bp.topics = []
-                if topic.uuid not in [t['uuid'] for t in bp.topics]:
-                    bp.topics.append({"uuid": topic.uuid})
-                    print(topic.blogposts)
-                    topic.blogposts.append(bp.id)
-                    print("合并后: ", topic.blogposts)
-                    print(f"将博文{bp.id}: 关键词{bp.keywords}合并到话题{topic.uuid}: 关键词{topic.keywords}")
-                    topic.post_count += 1
-                    session.add(bp)
-                    session.add(topic)
-
+    # 批量匹配没有话题的博文，匹配到的博文按话题收集，最后一次写入关联并计入话题的累加统计量
+    post_strings = [" ".join(bp.keywords) for bp in blogposts]
+    if use_bert:
+        from machine_learning import get_classifier_service
+
+        matches = match_keyword_strings_bert(get_classifier_service(), [topic.keywords for topic in topics],
+                                             post_strings, threshold)
+    else:
+        # 话题关键词的TF-IDF矩阵及其倒排索引从缓存读取，话题有增删或合并时只更新变化的行并重建索引
+        topics = {topic.uuid: topic for topic in topics}
+        vectorizer, topic_index, uuids = load_topic_vectors(
+            {uuid: " ".join(topic.keywords) for uuid, topic in topics.items()}, topic_vectors_path(session))
+        topics = [topics[uuid] for uuid in uuids]
+        matches = match_keyword_strings(vectorizer, topic_index, [topic.keywords for topic in topics],
+                                        post_strings, MATCH_THRESHOLD if threshold is None else threshold)
+    matched_posts = {}
+    for post_index, topic_index in matches:
+        matched_posts.setdefault(topics[topic_index], []).append(blogposts[post_index])
+    session.bulk_insert_mappings(TopicPost, [{'topic_uuid': topics[topic_index].uuid, 'post_id': blogposts[post_index].id}
+                                             for post_index, topic_index in matches])
+    for topic, posts in matched_posts.items():
+        update_topic_stats(topic, added=[post_values(bp) for bp in posts])
+    print(f"{len(blogposts)}条博文中有{len({post_index for post_index, _ in matches})}条匹配到话题，"
+          f"共{len(matches)}条话题关联")
     session.commit()
     session.close()
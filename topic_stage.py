@@ -1,10 +1,11 @@
-from datetime import datetime, timedelta
+from datetime import datetime
 from data_analysis import get_blogposts_for_topic
+from topic_aggregates import BUCKET, NUM_BUCKETS, bucket_anchor
 from topic_hot_rate import calculate_hot_rate, get_weight
 from models import Topic
 
-# 更新某一topic的post_freq_per_hr属性
-def update_topic_hot_rate_per_hr(session_db, topic_uuid):
+# 更新某一topic的post_freq_per_hr属性，分段边界对齐到 bucket_anchor(now)
+def update_topic_hot_rate_per_hr(session_db, topic_uuid, now=None):
     topic = session_db.query(Topic).filter_by(uuid=topic_uuid).first()
     if not topic:
         return
@@ -15,10 +16,11 @@ def update_topic_hot_rate_per_hr(session_db, topic_uuid):
 
     post_count_weight, avg_likes_weight, avg_comments_weight, avg_reposts_weight = get_weight(session_db)
 
+    anchor = bucket_anchor(now or datetime.now())
     hot_rate_per_hr = {}
-    for i in range(24):
-        start_time = datetime.now() - timedelta(hours=(i + 1) * 3)
-        end_time = datetime.now() - timedelta(hours=i * 3)
+    for i in range(NUM_BUCKETS):
+        start_time = anchor - (i + 1) * BUCKET
+        end_time = anchor - i * BUCKET
         relevant_posts = [bp for bp in blogposts if start_time <= bp.date < end_time]
         if relevant_posts:
             avg_hot_rate = calculate_hot_rate(
@@ -36,18 +38,11 @@ def update_topic_hot_rate_per_hr(session_db, topic_uuid):
         hot_rate_per_hr[i] = avg_hot_rate
 
     topic.hot_rate_per_hr = hot_rate_per_hr
+    topic.hot_rate_per_hr_at = anchor
     session_db.add(topic)
     session_db.commit()
 
 
-# 更新所有topic的post_freq_per_hr属性
-def update_topics_hot_rate_per_hr(session_db):
-    topics = session_db.query(Topic).all()
-    for topic in topics:
-        update_topic_hot_rate_per_hr(session_db, topic.uuid)
-    session_db.commit()
-
-
 # 舆情预测，更新所有topic的stage字段
 def update_topics_stage(session_db):
     topics = session_db.query(Topic).all()
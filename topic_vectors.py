@@ -0,0 +1,150 @@
+import hashlib
+import math
+import os
+import pickle
+from topic_index import build_topic_index
+
+# 话题TF-IDF矩阵缓存文件的后缀，缓存文件与数据库文件放在一起，每个数据库各有一份
+TOPIC_VECTORS_SUFFIX = '.topic_vectors.pkl'
+# 缓存中必须有的字段（倒排索引可由话题矩阵补建）
+TOPIC_VECTORS_KEYS = {'vocabulary', 'idf', 'doc_freq', 'fit_rows', 'changed_rows', 'uuids', 'strings', 'matrix',
+                      'fingerprint'}
+# 自上次拟合IDF以来增删的话题行数超过拟合时话题数的该比例时，重新拟合词表和IDF
+IDF_REFIT_DRIFT = 0.2
+
+
+# 数据库对应的话题矩阵缓存路径，内存数据库不缓存
+def topic_vectors_path(session_db):
+    database = session_db.get_bind().url.database
+    if not database or database == ':memory:':
+        return None
+    return database + TOPIC_VECTORS_SUFFIX
+
+
+# 话题集合的指纹：topic_strings为 话题uuid -> 空格连接的关键词
+def topic_set_fingerprint(topic_strings):
+    digest = hashlib.sha1()
+    for uuid in sorted(topic_strings):
+        digest.update(f'{uuid}\t{topic_strings[uuid]}\n'.encode('utf-8'))
+    return digest.hexdigest()
+
+
+# 在全部话题上拟合TfidfVectorizer，得到词表、IDF、每个词出现的话题数、话题矩阵（行顺序与uuids一致）及其倒排索引
+def fit_topic_vectors(topic_strings):
+    import numpy as np
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
+    uuids = list(topic_strings)
+    vectorizer = TfidfVectorizer()
+    matrix = vectorizer.fit_transform([topic_strings[uuid] for uuid in uuids]).tocsr()
+    return {
+        'vocabulary': dict(vectorizer.vocabulary_),
+        'idf': vectorizer.idf_,
+        'doc_freq': np.bincount(matrix.indices, minlength=len(vectorizer.vocabulary_)),
+        'fit_rows': len(uuids),
+        'changed_rows': 0,
+        'uuids': uuids,
+        'strings': dict(topic_strings),
+        'matrix': matrix,
+        'index': build_topic_index(matrix),
+        'fingerprint': topic_set_fingerprint(topic_strings)
+    }
+
+
+# 读取path处的话题矩阵缓存；文件不存在、损坏（无法反序列化、被截断）或缺少字段时返回None
+def read_topic_vectors(path):
+    try:
+        with open(path, 'rb') as f:
+            cache = pickle.load(f)
+    except Exception:
+        return None
+    if not isinstance(cache, dict) or not TOPIC_VECTORS_KEYS <= cache.keys():
+        return None
+    return cache
+
+
+# 先写入带进程号的临时文件再替换，其他进程不会读到写了一半的缓存
+def save_topic_vectors(cache, path):
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+# 由缓存的词表和IDF构造可直接transform的向量化器
+def cached_vectorizer(cache):
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
+    vectorizer = TfidfVectorizer(vocabulary=cache['vocabulary'])
+    vectorizer.idf_ = cache['idf']
+    return vectorizer
+
+
+# 按当前话题集合增量更新缓存：删除的话题（包括关键词变化的话题）去掉对应的行，新增的话题追加行，
+# 新出现的词追加到词表末尾，IDF按当前的话题数计算；其余话题的行和已有词的IDF不变。
+# 话题矩阵变化后重建倒排索引。增删的行数累计超过 IDF_REFIT_DRIFT 时重新拟合
+def update_topic_vectors(cache, topic_strings):
+    import numpy as np
+    from scipy import sparse
+
+    old_strings = cache['strings']
+    removed = {uuid for uuid, string in old_strings.items() if topic_strings.get(uuid) != string}
+    added = [uuid for uuid, string in topic_strings.items() if old_strings.get(uuid) != string]
+    changed_rows = cache['changed_rows'] + len(removed) + len(added)
+    if changed_rows > IDF_REFIT_DRIFT * max(cache['fit_rows'], 1):
+        return fit_topic_vectors(topic_strings)
+
+    vocabulary = cache['vocabulary']
+    analyzer = cached_vectorizer(cache).build_analyzer()
+    doc_freq = cache['doc_freq']
+    for uuid in removed:
+        for term in set(analyzer(old_strings[uuid])):
+            doc_freq[vocabulary[term]] -= 1
+    keep = [i for i, uuid in enumerate(cache['uuids']) if uuid not in removed]
+    matrix = cache['matrix'][keep]
+    uuids = [cache['uuids'][i] for i in keep]
+
+    new_terms = []
+    added_terms = [set(analyzer(topic_strings[uuid])) for uuid in added]
+    for terms in added_terms:
+        for term in terms:
+            if term not in vocabulary:
+                vocabulary[term] = len(vocabulary)
+                new_terms.append(term)
+    doc_freq = np.concatenate([doc_freq, np.zeros(len(new_terms), dtype=doc_freq.dtype)])
+    for terms in added_terms:
+        for term in terms:
+            doc_freq[vocabulary[term]] += 1
+    num_topics = len(uuids) + len(added)
+    idf = np.concatenate([cache['idf'], [math.log((1 + num_topics) / (1 + doc_freq[vocabulary[term]])) + 1
+                                         for term in new_terms]])
+
+    cache = dict(cache, vocabulary=vocabulary, idf=idf, doc_freq=doc_freq, changed_rows=changed_rows)
+    matrix.resize(matrix.shape[0], len(vocabulary))
+    if added:
+        matrix = sparse.vstack([matrix, cached_vectorizer(cache).transform([topic_strings[uuid] for uuid in added])],
+                               format='csr')
+    cache.update(uuids=uuids + added, strings=dict(topic_strings), matrix=matrix, index=build_topic_index(matrix),
+                 fingerprint=topic_set_fingerprint(topic_strings))
+    return cache
+
+
+# 读取话题的TF-IDF向量化器和话题矩阵的倒排索引：话题集合的指纹与path处的缓存一致时直接使用缓存，否则增量更新后写回
+# （path为None时不缓存）。倒排索引只在拟合或更新话题矩阵时建立，匹配时不再重建。
+# 缓存无法读取或内容不一致时重新拟合。返回 (向量化器, 倒排索引, 矩阵各行对应的话题uuid)
+def load_topic_vectors(topic_strings, path=None):
+    cache = read_topic_vectors(path) if path else None
+    if cache is None:
+        cache = fit_topic_vectors(topic_strings)
+    elif cache['fingerprint'] != topic_set_fingerprint(topic_strings):
+        try:
+            cache = update_topic_vectors(cache, topic_strings)
+        except (KeyError, IndexError, ValueError):
+            cache = fit_topic_vectors(topic_strings)
+    elif 'index' not in cache:
+        cache['index'] = build_topic_index(cache['matrix'])
+    else:
+        path = None
+    if path:
+        save_topic_vectors(cache, path)
+    return cached_vectorizer(cache), cache['index'], cache['uuids']